@@ -87,6 +87,7 @@ def main(arguments=None):
         if args.upload in ('all', 'c'):
             cu = szkapi.CampaignUpload(config_file='szk_campaign_upload.xlsx')
             cu.upload_all_campaigns(api)
+        api.log_connection_reuse()
     if args.api in ('all', 'dcm'):
         api = dcapi.DcApi(config_file='dcapi.json')
         if args.upload in ('all', 'c'):
@@ -121,6 +122,7 @@ def main(arguments=None):
             ctv = tikapi.CreativeUpload(id_file_name='tik_creative_ids.csv')
             adu = tikapi.AdUpload(config_file='ad_upload.xlsx')
             results.extend(adu.upload_all_ads(api, ctv) or [])
+        api.log_connection_reuse()
     return {'results': results}
 
 
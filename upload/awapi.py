@@ -1,19 +1,140 @@
 import os
 import sys
 import yaml
+import json
 import uuid
-import base64
+import hashlib
 import logging
-import requests
+import itertools
+import threading
+import contextlib
 import numpy as np
 import pandas as pd
 import datetime as dt
-from requests_oauthlib import OAuth2Session
-from urllib3.exceptions import ConnectionError, NewConnectionError
 import uploader.upload.utils as utl
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 aw_path = 'aw'
 config_path = os.path.join(utl.config_file_path, aw_path)
+snapshot_file = os.path.join(config_path, 'snapshots.db')
+login_cache_file = os.path.join(config_path, 'login_customer_ids.json')
+
+
+age_range_types = {
+    503001: 'AGE_RANGE_18_24', 503002: 'AGE_RANGE_25_34',
+    503003: 'AGE_RANGE_35_44', 503004: 'AGE_RANGE_45_54',
+    503005: 'AGE_RANGE_55_64', 503006: 'AGE_RANGE_65_UP',
+    503999: 'AGE_RANGE_UNDETERMINED'}
+gender_types = {10: 'MALE', 11: 'FEMALE', 20: 'UNDETERMINED'}
+device_types = {30000: 'DESKTOP', 30001: 'MOBILE', 30002: 'TABLET'}
+
+# Formatted target (see ``Target.format_map``) -> REST criterion fields,
+# by the target's old SOAP ``xsi_type``.
+criterion_formats = {
+    'Keyword': lambda x, cid: {'keyword': {
+        'text': '{}'.format(x['text']), 'matchType': x['matchType']}},
+    'Placement': lambda x, cid: {'placement': {'url': x['url']}},
+    'Vertical': lambda x, cid: {'topic': {
+        'topicConstant': 'topicConstants/{}'.format(x['verticalId'])}},
+    'CriterionUserInterest': lambda x, cid: {'userInterest': {
+        'userInterestCategory': 'customers/{}/userInterests/{}'.format(
+            cid, x['userInterestId'])}},
+    'AgeRange': lambda x, cid: {'ageRange': {
+        'type': age_range_types[int(x['id'])]}},
+    'Gender': lambda x, cid: {'gender': {'type': gender_types[int(x['id'])]}},
+    'Language': lambda x, cid: {'language': {
+        'languageConstant': 'languageConstants/{}'.format(x['id'])}},
+    'Location': lambda x, cid: {'location': {
+        'geoTargetConstant': 'geoTargetConstants/{}'.format(x['id'])}},
+    'Platform': lambda x, cid: {'device': {
+        'type': device_types[int(x['id'])]}}}
+
+
+def _content_hash(file_path, block=1 << 20):
+    """sha256 of a file, read a block at a time."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for data in iter(lambda: f.read(block), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _config_values(config, col):
+    """Every row's ``col`` value in a loaded upload config."""
+    return [config[x].get(col) for x in config]
+
+
+mutate_fields = ('operations', 'mutate_operations', 'mutateOperations')
+
+
+def _mutate_outcomes(r, count):
+    """Per-operation ``(resource_name, error)`` for a Google Ads
+    ``mutate`` response to ``count`` operations, ``error`` being
+    ``(message, code)`` or None. A request-level error fails every
+    operation; under ``partialFailure`` each failed operation is found
+    by its index in ``partialFailureError``. Cross-resource
+    ``googleAds:mutate`` responses, whose rows wrap the resourceName in
+    a per-type result, are read the same way.
+    """
+    body = utl.response_body(r)
+    if 'error' in body:
+        err = body.get('error') or {}
+        error = (err.get('message') or 'Unknown error from Google Ads',
+                 err.get('code'))
+        return [(None, error)] * count
+    rows = body.get('results') or body.get('mutateOperationResponses') or []
+    failure = body.get('partialFailureError') or {}
+    errors = {}
+    for detail in failure.get('details') or []:
+        for err in detail.get('errors') or []:
+            path = (err.get('location') or {}).get('fieldPathElements') or []
+            index = next((x.get('index', 0) for x in path
+                          if x.get('fieldName') in mutate_fields), 0)
+            code = next(iter((err.get('errorCode') or {}).values()), None)
+            errors.setdefault(index, (err.get('message'), code))
+    outcomes = []
+    for idx in range(count):
+        row = (rows[idx] if idx < len(rows) else None) or {}
+        if 'resourceName' not in row and len(row) == 1:
+            row = next(iter(row.values())) or {}
+        if idx in errors:
+            outcomes.append((None, errors[idx]))
+        elif row.get('resourceName'):
+            outcomes.append((row['resourceName'], None))
+        else:
+            outcomes.append((None, (
+                failure.get('message')
+                or 'Google Ads mutate returned no results',
+                failure.get('code'))))
+    return outcomes
+
+
+def _row_outcome(outcomes):
+    """One ``(resource_name, error)`` for a row sent as several
+    operations: the first error, else the last operation's resource
+    (the campaign after its budget)."""
+    error = next((x[1] for x in outcomes if x[1]), None)
+    return (None, error) if error else outcomes[-1]
+
+
+def _remove_operation(op, resource_name):
+    """Operation undoing ``op``'s create of ``resource_name``, in the
+    same per-type wrapping for the ``googleAds`` service."""
+    key = next(iter(op))
+    if key in ('create', 'update', 'remove'):
+        return {'remove': resource_name}
+    return {key: {'remove': resource_name}}
+
+
+def _fill_aw_result(result, resource_name, error=None, duplicate=False):
+    """Fill ``result`` with platform_id / status / error for one mutate
+    operation. A ``duplicate`` row resolves to the object its twin in
+    the same request created."""
+    if error:
+        utl.fail_result(result, *error)
+        return
+    result['platform_id'] = resource_name.rsplit('/', 1)[-1]
+    result['status'] = 'skipped_exists' if duplicate else 'created'
 
 
 def _populate_aw_result(result, r):
@@ -21,21 +142,7 @@ def _populate_aw_result(result, r):
     Ads ``mutate`` response. ``r`` is the ``requests.Response``
     returned by ``AwApi.mutate_service``.
     """
-    body = utl.response_body(r)
-    if 'error' in body:
-        err = body.get('error') or {}
-        utl.fail_result(
-            result, err.get('message') or 'Unknown error from Google Ads',
-            err.get('code'))
-        return
-    rows = body.get('results') or []
-    if not rows:
-        utl.fail_result(result, 'Google Ads mutate returned no results')
-        return
-    resource_name = (rows[0] or {}).get('resourceName')
-    if resource_name:
-        result['platform_id'] = resource_name.rsplit('/', 1)[-1]
-    result['status'] = 'created'
+    _fill_aw_result(result, *_mutate_outcomes(r, 1)[0])
 
 
 class AwApi(object):
@@ -44,6 +151,16 @@ class AwApi(object):
     refresh_url = 'https://www.googleapis.com/oauth2/v3/token'
     access_url = '{}:listAccessibleCustomers'.format(base_url[:-1])
     report_url = '/googleAds:searchStream'
+    rate_limits = {'read': 10, 'write': 5, 'upload': 2}
+    # Google Ads accepts at most 10,000 operations per mutate request.
+    max_mutate_operations = 10000
+    cross_resource_service = 'googleAds'
+    criterion_services = {'adGroup': 'adGroupCriteria',
+                          'campaign': 'campaignCriteria'}
+    # Names per ``IN (...)`` list in a targeted lookup query.
+    lookup_chunk = 200
+    lookup_fields = {'cam_dict': 'campaign.name', 'ag_dict': 'ad_group.name',
+                     'ad_dict': 'ad_group.name'}
 
     def __init__(self, config_file=None):
         self.config_file = config_file
@@ -58,10 +175,29 @@ class AwApi(object):
         self.config_list = []
         self.adwords_client = None
         self.client = None
+        self.token_manager = None
         self.login_customer_id = None
         self.cam_dict = {}
         self.ag_dict = {}
         self.ad_dict = {}
+        self.snapshots = utl.SnapshotStore(snapshot_file, aw_path, None)
+        self.snapshot_scopes = {}
+        self.lookup_names = {}
+        self.lookup_limit = 1000
+        self.ad_prints = None
+        self.ad_prints_source = None
+        self.ad_prints_lock = threading.Lock()
+        self.upload_workers = utl.DEFAULT_WORKERS
+        self.batch_size = 1
+        self.criteria_batch_size = 5000
+        self.cross_resource = True
+        self.temp_ids = itertools.count(1)
+        self.batch_depth = 0
+        self.batch_lock = threading.Lock()
+        self.pending = {}
+        self.pending_keys = {}
+        self.limiter = utl.RateLimiter.from_config(self.rate_limits)
+        self.retry = utl.RetryPolicy(label='Adwords')
         self.v = 'v201809'
         if self.config_file:
             self.input_config(self.config_file)
@@ -96,7 +232,22 @@ class AwApi(object):
         if 'login_customer_id' in self.config:
             self.login_customer_id = self.config['login_customer_id']
         else:
-            self.login_customer_id = ''
+            self.login_customer_id = self.cached_login_customer_id()
+        self.upload_workers = utl.config_workers(self.config)
+        self.batch_size = min(self.max_mutate_operations, utl.config_int(
+            self.config, 'batch_size', 1))
+        self.criteria_batch_size = min(
+            self.max_mutate_operations, utl.config_int(
+                self.config, 'criteria_batch_size', 5000))
+        self.cross_resource = self.config.get('cross_resource', True)
+        self.lookup_limit = utl.config_int(
+            self.config, 'lookup_limit', 1000)
+        self.snapshots = utl.SnapshotStore.from_config(
+            snapshot_file, aw_path, self.client_customer_id, self.config)
+        self.limiter = utl.RateLimiter.from_config(
+            self.rate_limits, self.config)
+        self.retry = utl.RetryPolicy.from_config(self.config, label='Adwords')
+        self.set_token_manager()
 
     def check_config(self):
         for item in self.config_list:
@@ -104,29 +255,21 @@ class AwApi(object):
                 logging.warning('{} not in AW config file.'.format(item))
                 sys.exit(0)
 
-    def refresh_client_token(self, extra, attempt=1):
-        try:
-            token = self.client.refresh_token(self.refresh_url, **extra)
-        except requests.exceptions.ConnectionError as e:
-            attempt += 1
-            if attempt > 100:
-                logging.warning('Max retries exceeded: {}'.format(e))
-                token = None
-            else:
-                logging.warning('Connection error retrying 60s: {}'.format(e))
-                token = self.refresh_client_token(extra, attempt)
-        return token
+    def set_token_manager(self):
+        """Token manager for the configured client. ``token_file`` in
+        the config (relative to ``config/aw``) persists the access token
+        between runs."""
+        token_file = (self.config or {}).get('token_file')
+        if token_file:
+            token_file = os.path.join(config_path, token_file)
+        self.token_manager = utl.OAuthTokenManager(
+            self.client_id, self.client_secret, self.refresh_token,
+            self.refresh_url, token_file=token_file)
 
     def get_client(self):
-        token = {'refresh_token': self.refresh_token,
-                 'token_type': 'Bearer',
-                 'expires_in': 3600,
-                 'expires_at': 1504135205.73}
-        extra = {'client_id': self.client_id,
-                 'client_secret': self.client_secret}
-        self.client = OAuth2Session(self.client_id, token=token)
-        token = self.refresh_client_token(extra)
-        self.client = OAuth2Session(self.client_id, token=token)
+        if not self.token_manager:
+            self.set_token_manager()
+        self.client = self.token_manager.get_session()
         header = self.get_headers()
         return header
 
@@ -146,40 +289,131 @@ class AwApi(object):
         url = '{}{}{}'.format(self.base_url, cid, url_type)
         return url
 
-    def request_report(self, report):
+    def send(self, method, url, endpoint_class='read', create=False,
+             **kwargs):
+        """Paced request on the shared client, retried per
+        ``self.retry`` on connection errors, throttling and 5xx; a
+        ``create`` only on errors the server can't have acted on."""
+        run = self.retry.run_write if create else self.retry.run
+        return run(self._send, method, url, endpoint_class, **kwargs)
+
+    def _send(self, method, url, endpoint_class, **kwargs):
+        self.limiter.wait(endpoint_class)
+        return self.client.request(method, url, **kwargs)
+
+    def request_report(self, report, stream=False):
         if self.login_customer_id:
             logging.info('Requesting Report.')
             headers = self.get_client()
             report_url = self.get_report_url()
-            try:
-                r = self.client.post(report_url, json=report, headers=headers)
-            except (ConnectionError, NewConnectionError) as e:
-                logging.warning('Connection error, retrying: \n{}'.format(e))
-                r = self.request_report(report)
+            r = self.send('POST', report_url, json=report, headers=headers,
+                          stream=stream)
         else:
             logging.warning('No login customer id, attempting to find.')
-            r = self.find_correct_login_customer_id(report)
+            r = self.find_correct_login_customer_id(report, stream=stream)
         return r
 
-    def find_correct_login_customer_id(self, report):
+    def report_rows(self, report, chunk_size=1 << 16):
+        """
+        Yields the rows of a searchStream report batch by batch as the
+        body arrives, so every batch is read and memory holds one batch
+        rather than the whole account.
+
+        :param report: GAQL request body
+        :param chunk_size: bytes read from the socket at a time
+        """
+        r = self.request_report(report, stream=True)
+        try:
+            if not r.ok:
+                logging.warning('Report request failed: {}'.format(
+                    utl.response_body(r)))
+                return
+            for batch in utl.iter_json_array(r.iter_content(chunk_size)):
+                if 'error' in batch:
+                    logging.warning('Report stream error: {}'.format(batch))
+                for row in batch.get('results') or []:
+                    yield row
+        finally:
+            r.close()
+
+    def cached_login_customer_id(self):
+        """Login customer id found for this client on an earlier run,
+        or '' when discovery has not succeeded yet."""
+        try:
+            with open(login_cache_file, 'r') as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            return ''
+        cid = str(self.client_customer_id or '').replace('-', '')
+        return cache.get(cid, '')
+
+    def cache_login_customer_id(self, login_customer_id):
+        cid = str(self.client_customer_id or '').replace('-', '')
+        try:
+            with open(login_cache_file, 'r') as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            cache = {}
+        cache[cid] = login_customer_id
+        utl.dir_check(config_path)
+        tmp = '{}.tmp'.format(login_cache_file)
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp, login_cache_file)
+
+    def probe_login_customer_id(self, customer_id, headers):
+        """True when the client answers a one-row query made through
+        ``customer_id`` as the login (manager) customer."""
+        headers = dict(headers, **{'login-customer-id': customer_id})
+        query = {'query': 'SELECT customer.id FROM customer LIMIT 1'}
+        try:
+            r = self.send('POST', self.get_report_url(), json=query,
+                          headers=headers)
+            return r.ok and isinstance(r.json(), list)
+        except Exception as e:
+            logging.debug('Customer id {} failed: {}'.format(customer_id, e))
+            return False
+
+    def find_correct_login_customer_id(self, report, stream=False):
+        """
+        Probes every accessible customer concurrently as the login
+        customer with a one-row query, keeps the first that can read the
+        client and caches it in ``login_customer_ids.json`` so later
+        runs skip the search. Then requests ``report`` with it.
+
+        :param report: GAQL request body to send once found
+        :param stream: stream the report response
+        :return: Response to the report
+        """
         headers = self.get_client()
-        r = self.client.get(self.access_url, headers=headers)
+        r = self.send('GET', self.access_url, headers=headers)
         response = r.json()
         if 'resourceNames' not in response:
             logging.warning(response)
-        customer_ids = response['resourceNames']
-        for customer_id in customer_ids:
-            customer_id = customer_id.replace('customers/', '')
-            logging.info('Attempting customer id: {}'.format(customer_id))
-            self.login_customer_id = customer_id
-            r = self.request_report(report)
-            if r.json() == [] or 'results' in r.json()[0]:
-                self.config['login_customer_id'] = self.login_customer_id
-                with open(self.configfile, 'w') as f:
-                    yaml.dump({'adwords': self.config}, f)
-                return r
-        logging.warning('Could not find customer ID exiting.')
-        sys.exit(0)
+        customer_ids = [x.replace('customers/', '')
+                        for x in response.get('resourceNames') or []]
+        logging.info('Probing {} customer ids.'.format(len(customer_ids)))
+        found = None
+        if customer_ids:
+            workers = min(len(customer_ids), utl.config_workers(
+                self.config, key='probe_workers', default=8))
+            pool = ThreadPoolExecutor(max_workers=workers)
+            try:
+                probes = {pool.submit(self.probe_login_customer_id, x,
+                                      headers): x for x in customer_ids}
+                for probe in as_completed(probes):
+                    if probe.result():
+                        found = probes[probe]
+                        break
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+        if not found:
+            logging.warning('Could not find customer ID exiting.')
+            sys.exit(0)
+        logging.info('Using login customer id: {}'.format(found))
+        self.login_customer_id = found
+        self.cache_login_customer_id(found)
+        return self.request_report(report, stream=stream)
 
     @staticmethod
     def get_operation(operand, operator='ADD'):
@@ -201,18 +435,167 @@ class AwApi(object):
         :param update_mask: Comma-joined field mask for updates
         :return: Response to the request
         """
-        url = self.get_report_url(url_type='/{}'.format(service))
-        url = '{}:mutate'.format(url)
+        return self.mutate_operations(
+            service, [self.mutate_operation(operand, operation, update_mask)])
+
+    @staticmethod
+    def mutate_operation(operand, operation='create', update_mask=None):
         op = {operation: operand}
         if update_mask:
             op['updateMask'] = update_mask
-        operand = {'operations': [op]}
+        return op
+
+    def mutate_operations(self, service, operations, partial_failure=False):
+        """One mutate request for many operations on ``service``. A
+        request holding several rows is sent with ``partialFailure`` so
+        a bad row fails alone; one row's operations (a budget and its
+        campaign) stay all-or-nothing. ``_mutate_outcomes`` maps the
+        response back per operation.
+
+        :param service: String value of the object to mutate
+        :param operations: list of ``mutate_operation`` dicts, or of
+            per-type ``mutateOperations`` for the ``googleAds`` service
+        :param partial_failure: let operations fail independently
+        :return: Response to the request
+        """
+        url = self.get_report_url(url_type='/{}'.format(service))
+        url = '{}:mutate'.format(url)
+        if service == self.cross_resource_service:
+            body = {'mutateOperations': operations}
+        else:
+            body = {'operations': operations}
+        if partial_failure:
+            body['partialFailure'] = True
         headers = self.get_client()
-        r = self.client.post(url, json=operand, headers=headers)
-        if 'error' in r.json():
-            logging.warning('Could not upload: {}'.format(r.json()))
+        endpoint_class = 'upload' if service == 'assets' else 'write'
+        r = self.send('POST', url, endpoint_class, create=True, json=body,
+                      headers=headers)
+        resp = utl.response_body(r)
+        if 'error' in resp or 'partialFailureError' in resp:
+            logging.warning('Could not upload: {}'.format(resp))
         return r
 
+    @contextlib.contextmanager
+    def batched(self):
+        """Queue the mutates ``submit_mutate``-d inside the block into
+        multi-operation requests of ``batch_limit`` per service, sending
+        whatever is still queued on exit. Without a ``batch_size`` above
+        one in the config every object is sent on its own, as before.
+        Mutates queued by callbacks while the outermost block flushes
+        (criteria of just-created ad groups) are sent before it ends."""
+        with self.batch_lock:
+            self.batch_depth += 1
+        try:
+            yield
+        finally:
+            try:
+                if self.batch_depth == 1:
+                    while self.pending:
+                        self.flush_mutates(next(iter(self.pending)))
+            finally:
+                with self.batch_lock:
+                    self.batch_depth -= 1
+
+    def batch_limit(self, service):
+        """Operations per request for ``service``; criteria are many and
+        small so they batch by ``criteria_batch_size``."""
+        if service in self.criterion_services.values():
+            return self.criteria_batch_size
+        return self.batch_size
+
+    def submit_mutate(self, service, operand, done, operation='create',
+                      update_mask=None, key=None, duplicate=None,
+                      operations=None):
+        """Mutate one object now, or queue it inside ``batched``.
+
+        :param service: String value of the object to mutate
+        :param operand: Dictionary of the object
+        :param done: callable(resource_name, error) for the outcome
+        :param operation: Mutate operation key ('create' or 'update')
+        :param update_mask: Comma-joined field mask for updates
+        :param key: identity of a create, so a twin queued in the same
+            request resolves to the first instead of creating twice
+        :param duplicate: the twin's callable(resource_name, error)
+        :param operations: the row's operations when it takes several,
+            e.g. a budget and the campaign using it; sent in one request
+            and reported together
+        """
+        ops = operations or [
+            self.mutate_operation(operand, operation, update_mask)]
+        limit = self.batch_limit(service)
+        if not (self.batch_depth and limit > 1):
+            r = self.mutate_operations(service, ops)
+            done(*_row_outcome(_mutate_outcomes(r, len(ops))))
+            return
+        with self.batch_lock:
+            if key and key in self.pending_keys:
+                self.pending_keys[key].append(duplicate or done)
+                return
+            if key:
+                self.pending_keys[key] = []
+            queue = self.pending.setdefault(service, [])
+            queue.append((ops, key, done))
+            full = sum(len(x[0]) for x in queue) >= limit
+        if full:
+            self.flush_mutates(service)
+
+    def flush_mutates(self, service):
+        """Send every queued ``service`` operation, ``batch_limit`` per
+        request without splitting a row, and hand each row its own
+        result or error."""
+        with self.batch_lock:
+            calls = self.pending.pop(service, [])
+        limit = self.batch_limit(service)
+        chunks = [[]]
+        for call in calls:
+            size = sum(len(x[0]) for x in chunks[-1])
+            if chunks[-1] and size + len(call[0]) > limit:
+                chunks.append([])
+            chunks[-1].append(call)
+        for chunk in chunks:
+            ops = [op for x in chunk for op in x[0]]
+            if not ops:
+                continue
+            try:
+                r = self.mutate_operations(service, ops,
+                                           partial_failure=len(chunk) > 1)
+                outcomes = _mutate_outcomes(r, len(ops))
+            except Exception as e:
+                outcomes = [(None, (str(e), None))] * len(ops)
+            start = 0
+            orphans = []
+            for row_ops, key, done in chunk:
+                row_outcomes = outcomes[start:start + len(row_ops)]
+                start += len(row_ops)
+                outcome = _row_outcome(row_outcomes)
+                if outcome[1]:
+                    orphans.extend(
+                        _remove_operation(op, x[0])
+                        for op, x in zip(row_ops, row_outcomes) if x[0])
+                done(*outcome)
+                with self.batch_lock:
+                    followers = self.pending_keys.pop(key, []) if key else []
+                for follower in followers:
+                    follower(*outcome)
+            if orphans:
+                self.remove_orphans(service, orphans)
+
+    def remove_orphans(self, service, operations):
+        """Remove what a partially failed request created for rows that
+        failed — under ``partialFailure`` a budget commits even when its
+        campaign is rejected — so every row stays all-or-nothing."""
+        logging.warning(f'Removing {len(operations)} objects left by '
+                        f'failed rows.')
+        try:
+            r = self.mutate_operations(service, operations,
+                                       partial_failure=len(operations) > 1)
+            failed = [x for x in _mutate_outcomes(r, len(operations))
+                      if x[1]]
+        except Exception as e:
+            failed = [(None, (str(e), None))]
+        for _, error in failed:
+            logging.warning(f'Could not remove orphaned object: {error[0]}')
+
     def probe_account(self):
         """(ok, message) — one-row GAQL read to verify the customer
         is reachable, for the live pre-flight checks."""
@@ -241,57 +624,88 @@ class AwApi(object):
         status = 'ENABLED' if activate else 'PAUSED'
         cid = str(self.client_customer_id or '').replace('-', '')
         results = []
-        for pid in platform_ids:
-            result = utl.new_update_result(pid)
-            if not service:
-                results.append(utl.fail_result(
-                    result,
-                    f'Unknown Google Ads level: {object_level}'))
-                continue
-            resource = f'customers/{cid}/{service}/{pid}'
-            operand = {'resourceName': resource, 'status': status}
-            try:
-                r = self.mutate_service(
-                    service, operand, operation='update',
-                    update_mask='status')
-                err = utl.response_body(r).get('error') or {}
-                if err:
-                    utl.fail_result(
+        with self.batched():
+            for pid in platform_ids:
+                result = utl.new_update_result(pid)
+                if not service:
+                    results.append(utl.fail_result(
                         result,
-                        err.get('message')
-                        or 'Unknown error from Google Ads',
-                        err.get('code'))
-            except Exception as e:
-                utl.fail_result(result, e)
-            results.append(result)
+                        f'Unknown Google Ads level: {object_level}'))
+                    continue
+                resource = f'customers/{cid}/{service}/{pid}'
+                operand = {'resourceName': resource, 'status': status}
+                try:
+                    self.submit_mutate(
+                        service, operand,
+                        lambda _, error, result=result: (
+                            error and utl.fail_result(result, *error)),
+                        operation='update', update_mask='status')
+                except Exception as e:
+                    utl.fail_result(result, e)
+                results.append(result)
         return results
 
-    def upload_creative(self, file_path):
+    def upload_creative(self, file_path, content_hash=None):
         """Upload a local image as a Google Ads image asset
         (``assets:mutate``; the old ``MediaService`` is gone) and
-        return its ids. Wire format unverified — validate on a real
-        account before relying on it in live ad creation.
+        return its ids. An image asset already named like the file is
+        reused without sending any bytes, and without a content hash,
+        since its bytes were never compared; otherwise the file is
+        base64-encoded into the request body as it is sent. Wire format
+        unverified — validate on a real account before relying on it in
+        live ad creation.
+
+        :param file_path: local image
+        :param content_hash: the file's sha256, when already known
+        :return: {'mediaId', 'referenceId', 'contentHash'}
         """
-        with open(file_path, 'rb') as f:
-            data = base64.b64encode(f.read()).decode('ascii')
-        operand = {'name': os.path.basename(file_path),
-                   'type': 'IMAGE',
-                   'imageAsset': {'data': data}}
-        r = self.mutate_service('assets', operand)
-        try:
-            body = r.json() if r is not None else {}
-        except (ValueError, AttributeError):
-            body = {}
-        if isinstance(body, list):
-            body = body[0] if body else {}
-        results = (body or {}).get('results') or []
-        resource_name = results[0].get('resourceName') if results else None
+        name = os.path.basename(file_path)
+        resource_name = self.find_image_asset(name)
+        uploaded = False
+        if resource_name:
+            logging.warning(
+                'Image asset {} already in account; reusing it by name '
+                'without comparing its content.'.format(name))
+        else:
+            uploaded = True
+            r = self.retry.run_write(self.send_image_asset, file_path, name)
+            body = utl.response_body(r)
+            if 'error' in body:
+                logging.warning('Could not upload: {}'.format(body))
+            results = body.get('results') or []
+            resource_name = (results[0].get('resourceName')
+                             if results else None)
         asset_id = (resource_name.rsplit('/', 1)[-1]
                     if resource_name else None)
-        return {'mediaId': asset_id, 'referenceId': resource_name}
+        ids = {'mediaId': asset_id, 'referenceId': resource_name}
+        if asset_id and uploaded:
+            ids['contentHash'] = content_hash or _content_hash(file_path)
+        return ids
+
+    def find_image_asset(self, name):
+        """resourceName of an image asset called ``name``, or None."""
+        query = {'query': (
+            "SELECT asset.resource_name FROM asset WHERE asset.type = "
+            "'IMAGE' AND asset.name = {} LIMIT 1".format(
+                self.gaql_string(name)))}
+        for row in self.report_rows(query):
+            return (row.get('asset') or {}).get('resourceName')
+        return None
+
+    def send_image_asset(self, file_path, name):
+        """One ``assets:mutate`` attempt with the image streamed into
+        the body; a fresh body per attempt so retries resend it whole."""
+        url = '{}:mutate'.format(self.get_report_url(url_type='/assets'))
+        headers = self.get_client()
+        operand = {'name': name, 'type': 'IMAGE',
+                   'imageAsset': {'data': '@data@'}}
+        body = utl.Base64JsonBody(
+            file_path, {'operations': [{'create': operand}]})
+        self.limiter.wait('upload')
+        return self.client.request('POST', url, data=body, headers=headers)
 
     def get_id_dict(self, service='campaign', parent=None, page_len=100,
-                    fields=None, nest=None, selector_fields=True):
+                    fields=None, nest=None, selector_fields=True, where=None):
         if selector_fields:
             selector_fields = ['id', 'status']
         else:
@@ -301,44 +715,35 @@ class AwApi(object):
                 selector_fields.extend(list(x.keys()))
         gaql_fields = ['{}.{}'.format(service, x) for x in selector_fields]
         base_query = f"SELECT {', '.join(gaql_fields)} FROM {service}"
+        if where:
+            base_query = f"{base_query} WHERE {where}"
         body = {
             "query": base_query,
         }
-        r = self.request_report(body)
         resp_val = [x.capitalize() if idx != 0 else x for idx, x in
                     enumerate(service.split('_'))]
         resp_val = ''.join(resp_val)
-        id_dict = {}
-        results = r.json()
-        if results:
-            for x in r.json()[0]['results']:
-                name_val = 'name'
-                id_val = 'id'
-                if name_val not in x[resp_val]:
-                    name_val = 'resourceName'
-                    id_val = name_val
-                name = x[resp_val][name_val]
-                cur_id = x[resp_val][id_val]
-                id_dict[name] = {'id': cur_id, 'name': name}
-                if parent:
-                    parent_key = list(parent.keys())[0]
-                    if parent_key not in x[resp_val]:
-                        parent_key = [x.capitalize() if idx != 0 else x for
-                                      idx, x in
-                                      enumerate(parent_key.split('_'))]
-                        parent_key = ''.join(parent_key)
-                    parent_val = x[resp_val][parent_key]
-                    id_dict[name]['parent'] = parent_val
-        """
-        while more_pages:
-
-            id_dict = self.get_dict_from_page(id_dict, page,
-                                              list(parent.values())[0],
-                                              list(fields.values()), nest)
-            start_index += page_len
-            selector['paging']['startIndex'] = str(start_index)
-            more_pages = start_index < int(page['totalNumEntries'])
-        """
+        id_dict = utl.IdDict()
+        for x in self.report_rows(body):
+            name_val = 'name'
+            id_val = 'id'
+            if name_val not in x[resp_val]:
+                name_val = 'resourceName'
+                id_val = name_val
+            name = x[resp_val][name_val]
+            cur_id = x[resp_val][id_val]
+            row = {'id': cur_id, 'name': name}
+            if parent:
+                parent_key = list(parent.keys())[0]
+                if parent_key not in x[resp_val]:
+                    parent_key = [x.capitalize() if idx != 0 else x for
+                                  idx, x in
+                                  enumerate(parent_key.split('_'))]
+                    parent_key = ''.join(parent_key)
+                parent_val = x[resp_val][parent_key]
+                row['parent'] = parent_val
+                row['parent_id'] = str(parent_val).rsplit('/', 1)[-1]
+            id_dict[cur_id] = row
         return id_dict
 
     @staticmethod
@@ -354,7 +759,8 @@ class AwApi(object):
                         for x in page['entries'] if 'entries'})
         return id_dict
 
-    def set_budget(self, name, budget, start_date, end_date):
+    @staticmethod
+    def budget_operand(name, budget, start_date, end_date):
         start = dt.datetime.strptime(start_date, "%Y-%m-%d").date()
         end = dt.datetime.strptime(end_date, "%Y-%m-%d").date()
         total_days = (end - start).days + 1
@@ -364,24 +770,36 @@ class AwApi(object):
             'name': '{}-{}'.format(name, uuid.uuid4()),
             "amountMicros": int(daily_budget * 1000000),
         }
+        return budget
+
+    def temp_resource(self, service):
+        """Negative temporary resourceName, so later operations in the
+        same ``googleAds:mutate`` request can refer to an object before
+        it exists."""
+        cid = self.client_customer_id.replace('-', '')
+        return 'customers/{}/{}/-{}'.format(cid, service, next(self.temp_ids))
+
+    def set_budget(self, name, budget, start_date, end_date):
+        budget = self.budget_operand(name, budget, start_date, end_date)
         r = self.mutate_service('campaignBudgets', budget)
         budget_id = r.json()['results'][0]['resourceName']
         return budget_id
 
-    def get_campaign_id_dict(self):
+    def get_campaign_id_dict(self, where=None):
         # parent = {'BaseCampaignId': 'baseCampaignId'}
         fields = {'name': 'name'}
-        cam_dict = self.get_id_dict(service='campaign', fields=fields)
+        cam_dict = self.get_id_dict(service='campaign', fields=fields,
+                                    where=where)
         return cam_dict
 
-    def get_adgroup_id_dict(self):
+    def get_adgroup_id_dict(self, where=None):
         parent = {'campaign': 'campaign'}
         fields = {'name': 'name'}
         ag_dict = self.get_id_dict(service='ad_group', fields=fields,
-                                   parent=parent)
+                                   parent=parent, where=where)
         return ag_dict
 
-    def get_ad_dict(self):
+    def get_ad_dict(self, where=None):
         parent = {'ad_group': 'ad_group'}
         fields = [
             'ad.display_url', 'ad.final_urls',
@@ -393,29 +811,153 @@ class AwApi(object):
             'ad.expanded_text_ad.description2']
         fields = {x: x for x in fields}
         ad_dict = self.get_id_dict(service='ad_group_ad', parent=parent,
-                                   fields=fields, selector_fields=False)
+                                   fields=fields, selector_fields=False,
+                                   where=where)
         return ad_dict
 
+    def plan_lookups(self, campaigns=(), ad_groups=()):
+        """
+        Limits the next id dict listings to the campaign and ad group
+        names an upload config refers to, instead of the whole account.
+        A dict already listed for fewer names is dropped so its next
+        use relists with the wider plan.
+
+        :param campaigns: campaign names used by the config
+        :param ad_groups: ad group names used by the config
+        """
+        for field, names in (('campaign.name', campaigns),
+                             ('ad_group.name', ad_groups)):
+            names = {str(x) for x in names if str(x) not in ('', 'nan')}
+            planned = self.lookup_names.setdefault(field, set())
+            if not names - planned:
+                continue
+            planned.update(names)
+            for dict_attr, dict_field in self.lookup_fields.items():
+                if dict_field == field and self.snapshot_scopes.get(dict_attr):
+                    setattr(self, dict_attr, {})
+
+    @staticmethod
+    def gaql_string(value):
+        value = str(value).replace('\\', '\\\\').replace("'", "\\'")
+        return "'{}'".format(value)
+
+    def lookup_filters(self, dict_attr):
+        """
+        WHERE clauses selecting the planned names for ``dict_attr``,
+        ``lookup_chunk`` names per ``IN`` list so no query grows past
+        the GAQL length limit.
+
+        :param dict_attr: 'cam_dict', 'ag_dict' or 'ad_dict'
+        :return: list of clauses, or None for a full pull when nothing
+            is planned or more than ``lookup_limit`` names are, where the
+            chunked queries would cost more than listing everything
+        """
+        field = self.lookup_fields[dict_attr]
+        names = sorted(self.lookup_names.get(field) or ())
+        if not names or len(names) > self.lookup_limit:
+            return None
+        return ['{} IN ({})'.format(field, ', '.join(
+            self.gaql_string(x) for x in names[i:i + self.lookup_chunk]))
+            for i in range(0, len(names), self.lookup_chunk)]
+
+    @staticmethod
+    def planned_fetch(fetch, filters):
+        """``fetch`` run once per clause in ``filters`` and merged, still
+        taking the snapshot refresh's own ``where``."""
+        def planned(where=None):
+            id_dict = utl.IdDict()
+            for clause in filters:
+                if where:
+                    clause = '{} AND {}'.format(where, clause)
+                id_dict.update(fetch(where=clause))
+            return id_dict
+        return planned
+
+    def snapshot_id_dict(self, dict_attr, fetch, service=None):
+        """``fetch``'s id dict through the snapshot store, limited to the
+        planned names when there are any. With a ``service`` a stale
+        snapshot is topped up with the ids above the highest one it
+        holds, since ids only grow."""
+        filters = self.lookup_filters(dict_attr)
+        scope = ''
+        if filters:
+            fetch = self.planned_fetch(fetch, filters)
+            scope = hashlib.sha1('\n'.join(filters).encode()).hexdigest()
+        self.snapshot_scopes[dict_attr] = scope
+
+        def refresh_ids(since, id_dict):
+            last = max((int(k) for k in id_dict if str(k).isdigit()),
+                       default=0)
+            return fetch(where=f'{service}.id > {last}')
+
+        return self.snapshots.id_dict(
+            dict_attr, fetch, scope=scope,
+            refresh=refresh_ids if service else None)
+
     def set_id_dict(self, aw_object='all'):
         if aw_object in ['campaign', 'adgroup', 'ad', 'all']:
-            self.cam_dict = self.get_campaign_id_dict()
+            self.cam_dict = self.snapshot_id_dict(
+                'cam_dict', self.get_campaign_id_dict, 'campaign')
         if aw_object in ['adgroup', 'ad', 'all']:
-            self.ag_dict = self.get_adgroup_id_dict()
+            self.ag_dict = self.snapshot_id_dict(
+                'ag_dict', self.get_adgroup_id_dict, 'ad_group')
         if aw_object in ['ad', 'all']:
-            self.ad_dict = self.get_ad_dict()
+            self.ad_dict = self.snapshot_id_dict('ad_dict', self.get_ad_dict)
 
     @staticmethod
     def get_id(dict_o, match, dict_two=None, match_two=None, parent_id=None):
-        id_list = []
-        for k, v in dict_o.items():
-            if v['name'] == match:
-                if not parent_id or (parent_id and v['parent']):
-                    id_list.append(v['id'])
+        id_list = [dict_o[k]['id'] for k in utl.find_ids(
+            dict_o, match, parent_id=parent_id, parent_name='parent_id')]
         if dict_two is not None:
-            id_list = [k for k, v in dict_two.items() if v['name'] == match_two
-                       and v['parent'] == id_list[0]]
+            id_list = [dict_two[k]['id'] for k in utl.find_ids(
+                dict_two, match_two, parent_id=id_list[0],
+                parent_name='parent_id')] if id_list else []
         return id_list
 
+    def remember(self, dict_attr, key, row):
+        """Write a newly created object through to a listed id dict,
+        so later rows in the same run find it without relisting. A dict
+        that was never listed is left alone; listing it picks the
+        object up anyway.
+
+        :param dict_attr: 'cam_dict', 'ag_dict' or 'ad_dict'
+        :param key: id dict key (the id, or resourceName for ads)
+        :param row: row shaped like the ones get_id_dict builds
+        """
+        id_dict = getattr(self, dict_attr)
+        if key and isinstance(id_dict, utl.IdDict):
+            id_dict[key] = row
+            self.snapshots.put(dict_attr, key, row,
+                               self.snapshot_scopes.get(dict_attr, ''))
+
+    def ad_fingerprints(self, cu=None):
+        """
+        ``{ad group resource: {operand fingerprint}}`` for the listed
+        ads, built once per listing of ``ad_dict`` so checking a config
+        row is one hash probe instead of rebuilding every account ad.
+
+        :param cu: CreativeUpload resolving image references
+        :return: dict of fingerprint sets per ad group
+        """
+        with self.ad_prints_lock:
+            if (self.ad_prints is None
+                    or self.ad_prints_source is not self.ad_dict):
+                prints = {}
+                for row in list(self.ad_dict.values()):
+                    ad = Ad(row, cu)
+                    prints.setdefault(ad.parent, set()).add(ad.fingerprint())
+                self.ad_prints = prints
+                self.ad_prints_source = self.ad_dict
+            return self.ad_prints
+
+    def add_ad_fingerprint(self, ad):
+        """Record a created ad so a twin later in the run is skipped."""
+        with self.ad_prints_lock:
+            if (self.ad_prints is not None
+                    and self.ad_prints_source is self.ad_dict):
+                self.ad_prints.setdefault(ad.parent, set()).add(
+                    ad.fingerprint())
+
     def check_exists(self, name, aw_object, object_dict, parent_id=None):
         if not object_dict:
             self.set_id_dict(aw_object)
@@ -424,56 +966,129 @@ class AwApi(object):
                             'This {} was not uploaded.'.format(name, aw_object))
             return True
 
-    def create_campaign(self, campaign, service='campaigns'):
-        budget_id = self.set_budget(campaign.name, campaign.budget,
-                                    campaign.startDate, campaign.endDate)
-        campaign.cam_dict['campaignBudget'] = budget_id
-        campaigns = self.mutate_service(service, campaign.cam_dict)
+    def create_campaign(self, campaign, result, service='campaigns'):
         """
-        campaign.id = campaigns['value'][0]['id']
-        self.add_targets(campaign, service='CampaignCriterionService',
-                         positive='CampaignCriterion',
-                         negative='NegativeCampaignCriterion',
-                         id_name='campaignId')
+        Creates the campaign's budget and the campaign. In the default
+        cross-resource mode both go in one ``googleAds:mutate`` request,
+        the campaign pointing at the budget's temporary resourceName;
+        with ``cross_resource: false`` in the config the budget is
+        created first on its own.
+
+        :param campaign: Campaign to create
+        :param result: row result, filled once the mutate is sent
+        :param service: String value of the object to mutate
+        :return: result
         """
-        return campaigns
+        operations = None
+        if self.cross_resource:
+            budget = self.budget_operand(campaign.name, campaign.budget,
+                                         campaign.startDate, campaign.endDate)
+            budget['resourceName'] = self.temp_resource('campaignBudgets')
+            campaign.cam_dict['campaignBudget'] = budget['resourceName']
+            operations = [
+                {'campaignBudgetOperation': {'create': budget}},
+                {'campaignOperation': {'create': campaign.cam_dict}}]
+            service = self.cross_resource_service
+        else:
+            budget_id = self.set_budget(campaign.name, campaign.budget,
+                                        campaign.startDate, campaign.endDate)
+            campaign.cam_dict['campaignBudget'] = budget_id
+
+        def done(resource_name, error):
+            _fill_aw_result(result, resource_name, error)
+            if resource_name:
+                cid = resource_name.rsplit('/', 1)[-1]
+                self.remember('cam_dict', cid,
+                              {'id': cid, 'name': campaign.name})
+                self.add_targets(campaign, resource_name, 'campaign')
+
+        self.submit_mutate(
+            service, campaign.cam_dict, done, key=('campaign', campaign.name),
+            duplicate=lambda *x: _fill_aw_result(result, *x, duplicate=True),
+            operations=operations)
+        return result
 
-    def create_adgroup(self, ag, service='adGroups'):
+    def create_adgroup(self, ag, result, service='adGroups'):
         """
         https://developers.google.com/google-ads/api/reference/rpc/v22/AdGroup
 
         :param ag:
+        :param result: row result, filled once the mutate is sent
         :param service:
-        :return:
+        :return: result
         """
-        ad_groups = self.mutate_service(service, ag.ag_dict)
+        def done(resource_name, error):
+            _fill_aw_result(result, resource_name, error)
+            if resource_name:
+                ag_id = resource_name.rsplit('/', 1)[-1]
+                self.remember('ag_dict', ag_id, {
+                    'id': ag_id, 'name': ag.name, 'parent': ag.parent,
+                    'parent_id': str(ag.parent).rsplit('/', 1)[-1]})
+                self.add_targets(ag, resource_name)
+
+        self.submit_mutate(
+            service, ag.ag_dict, done, key=('adgroup', ag.parent, ag.name),
+            duplicate=lambda *x: _fill_aw_result(result, *x, duplicate=True))
+        return result
+
+    def add_targets(self, aw_object, resource_name, level='adGroup'):
         """
-        ag.id = ad_groups['value'][0]['id']
-        self.add_targets(ag)
+        Creates the criteria built by ``TargetConfig.load_targets`` on a
+        new ad group or campaign through ``adGroupCriteria:mutate`` or
+        ``campaignCriteria:mutate``. Criteria are queued, so those of
+        many objects share requests of ``criteria_batch_size`` sent with
+        partial failure; a rejected criterion is logged and skipped.
+
+        https://developers.google.com/google-ads/api/reference/rpc/v22/AdGroupCriterion
+
+        :param aw_object: AdGroup or Campaign with its target lists
+        :param resource_name: resourceName the object was created as
+        :param level: 'adGroup' or 'campaign'
         """
-        return ad_groups
-
-    def add_targets(self, aw_object, service='AdGroupCriterionService',
-                    positive='BiddableAdGroupCriterion',
-                    negative='NegativeAdGroupCriterion', id_name='adGroupId'):
-        targets = [{'xsi_type': positive, 'operator': 'ADD',
-                    'dict': aw_object.target_dict},
-                   {'xsi_type': negative, 'operator': 'ADD',
-                    'dict': aw_object.negative_target_dict},
-                   {'dict': aw_object.bid_dict, 'operator': 'SET',
-                    'bidModifier': 0.0}]
-        for target in targets:
-            if target['dict']:
-                base_operand = {x: target[x] for x in target
-                                if x not in ['dict', 'operator']}
-                base_operand[id_name] = aw_object.id
-                operand = [{'criterion': x} for x in target['dict']]
-                [x.update(base_operand) for x in operand]
-                self.mutate_service(service, operand, target['operator'])
-
-    def create_ad(self, ad):
-        ads = self.mutate_service('adGroupAds', ad.operand)
-        return ads
+        service = self.criterion_services[level]
+        cid = self.client_customer_id.replace('-', '')
+        targets = [(getattr(aw_object, 'target_dict', None), {}),
+                   (getattr(aw_object, 'negative_target_dict', None),
+                    {'negative': True}),
+                   (getattr(aw_object, 'bid_dict', None),
+                    {'bidModifier': 0.0})]
+        with self.batched():
+            for target_list, extra in targets:
+                if not isinstance(target_list, list):
+                    continue
+                for target in target_list:
+                    try:
+                        criterion = criterion_formats[target['xsi_type']](
+                            target, cid)
+                    except (KeyError, ValueError, TypeError):
+                        logging.warning('Unknown {} target for {}: {}'.format(
+                            level, aw_object.name, target))
+                        continue
+                    operand = {level: resource_name}
+                    operand.update(criterion)
+                    operand.update(extra)
+                    self.submit_mutate(
+                        service, operand,
+                        lambda _, error, x=target: error and logging.warning(
+                            'Could not add {} target {} to {}: {}'.format(
+                                level, x, aw_object.name, error[0])))
+
+    def create_ad(self, ad, result):
+        def done(resource_name, error):
+            _fill_aw_result(result, resource_name, error)
+            if resource_name:
+                row = {'id': resource_name, 'name': resource_name,
+                       'parent': ad.parent,
+                       'parent_id': str(ad.parent).rsplit('/', 1)[-1]}
+                row.update(ad.source_values())
+                self.remember('ad_dict', resource_name, row)
+                self.add_ad_fingerprint(ad)
+
+        self.submit_mutate(
+            'adGroupAds', ad.operand, done,
+            key=('ad', json.dumps(ad.operand, sort_keys=True, default=str)),
+            duplicate=lambda *x: _fill_aw_result(result, *x, duplicate=True))
+        return result
 
 
 class CampaignUpload(object):
@@ -527,17 +1142,22 @@ class CampaignUpload(object):
 
     def upload_all_campaigns(self, api):
         total_camp = str(len(self.config))
-        results = []
-        for idx, c_id in enumerate(self.config):
-            logging.info('Uploading campaign {} of {}.  '
-                         'Campaign Name: {}'.format(idx + 1, total_camp, c_id))
-            result = self.upload_campaign(api, c_id)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[c_id], self.snapshot_cols)
-            results.append(result)
+        api.plan_lookups(campaigns=_config_values(self.config, self.name))
+        with api.batched():
+            results = utl.run_concurrent(
+                lambda x: self.upload_row(api, total_camp, *x),
+                enumerate(self.config), api.upload_workers)
         logging.info('Campaigns finished uploading.')
         return results
 
+    def upload_row(self, api, total_camp, idx, c_id):
+        logging.info('Uploading campaign {} of {}.  '
+                     'Campaign Name: {}'.format(idx + 1, total_camp, c_id))
+        result = self.upload_campaign(api, c_id)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[c_id], self.snapshot_cols)
+        return result
+
     def upload_campaign(self, api, campaign_id):
         campaign = self.set_campaign(campaign_id)
         result = {
@@ -556,9 +1176,7 @@ class CampaignUpload(object):
                 result['platform_id'] = str(existing[0])
             result['status'] = 'skipped_exists'
             return result
-        r = api.create_campaign(campaign)
-        _populate_aw_result(result, r)
-        return result
+        return api.create_campaign(campaign, result)
 
 
 class Campaign(object):
@@ -743,16 +1361,22 @@ class AdGroupUpload(object):
 
     def upload_all_adgroups(self, api):
         tot_ag = str(len(self.config))
-        results = []
-        for idx, ag_id in enumerate(self.config):
-            logging.info('Uploading adgroup {} of {}.'.format(idx + 1, tot_ag))
-            result = self.upload_adgroup(api, ag_id)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[ag_id], self.snapshot_cols)
-            results.append(result)
+        api.plan_lookups(campaigns=_config_values(self.config, self.cam_name),
+                         ad_groups=_config_values(self.config, self.name))
+        with api.batched():
+            results = utl.run_concurrent(
+                lambda x: self.upload_row(api, tot_ag, *x),
+                enumerate(self.config), api.upload_workers)
         logging.info('{} adgroups uploaded.'.format(tot_ag))
         return results
 
+    def upload_row(self, api, tot_ag, idx, ag_id):
+        logging.info('Uploading adgroup {} of {}.'.format(idx + 1, tot_ag))
+        result = self.upload_adgroup(api, ag_id)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[ag_id], self.snapshot_cols)
+        return result
+
     def upload_adgroup(self, api, ag_id):
         ag = self.set_adgroup(ag_id)
         logging.info('Adgroup name: {}'.format(ag.name))
@@ -772,9 +1396,110 @@ class AdGroupUpload(object):
                 result['platform_id'] = str(existing[0])
             result['status'] = 'skipped_exists'
             return result
-        r = api.create_adgroup(ag)
-        _populate_aw_result(result, r)
-        return result
+        return api.create_adgroup(ag, result)
+
+
+class TargetMap(object):
+    """
+    Name -> criterion id table for one target map CSV (aw_locations.csv
+    and friends). The CSV is compiled once into sorted UTF-8 keys and
+    their ids, saved as ``.npy`` files under ``cache`` beside it and
+    memory-mapped back, so a lookup is a binary search touching a few
+    pages rather than a parse of the file. The cache and the per-process
+    tables are keyed by the CSV's mtime and rebuilt when it changes.
+    """
+    cache_dir = 'cache'
+    tables = {}
+    lock = threading.Lock()
+
+    def __init__(self, keys, ids):
+        self.keys = keys
+        self.ids = ids
+
+    @classmethod
+    def load(cls, map_file, key_col, id_col):
+        mtime = os.stat(map_file).st_mtime_ns
+        name = (os.path.abspath(map_file), key_col, id_col)
+        with cls.lock:
+            cached = cls.tables.get(name)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            paths = cls.cache_paths(map_file, key_col, id_col)
+            table = cls.read_cache(paths, mtime)
+            if table is None:
+                table = cls.compile(map_file, key_col, id_col)
+                cls.write_cache(paths, mtime, table)
+            cls.tables[name] = (mtime, table)
+            return table
+
+    @classmethod
+    def cache_paths(cls, map_file, key_col, id_col):
+        cols = hashlib.sha1('{}|{}'.format(key_col, id_col).encode())
+        base = os.path.join(
+            os.path.dirname(map_file), cls.cache_dir, '{}.{}'.format(
+                os.path.basename(map_file), cols.hexdigest()[:12]))
+        return {x: '{}.{}'.format(base, x) for x in ('keys.npy', 'ids.npy',
+                                                     'json')}
+
+    @classmethod
+    def compile(cls, map_file, key_col, id_col):
+        vdf = pd.read_csv(map_file, usecols=[key_col, id_col])
+        vdf = vdf.dropna(subset=[key_col])
+        keys = np.array([str(x).encode('utf-8') for x in vdf[key_col]],
+                        dtype=bytes)
+        ids = vdf[id_col].to_numpy()
+        if ids.dtype == object:
+            ids = ids.astype(str)
+        # Reversed so np.unique keeps the last row of a repeated name,
+        # as the dict this replaces did.
+        keys, first = np.unique(keys[::-1], return_index=True)
+        return cls(keys, ids[::-1][first])
+
+    @staticmethod
+    def read_cache(paths, mtime):
+        try:
+            with open(paths['json'], 'r') as f:
+                if json.load(f).get('mtime_ns') != mtime:
+                    return None
+            return TargetMap(np.load(paths['keys.npy'], mmap_mode='r'),
+                             np.load(paths['ids.npy'], mmap_mode='r'))
+        except (IOError, ValueError):
+            return None
+
+    @staticmethod
+    def write_cache(paths, mtime, table):
+        try:
+            utl.dir_check(os.path.dirname(paths['json']))
+            for name, values in (('keys.npy', table.keys),
+                                 ('ids.npy', table.ids)):
+                tmp = '{}.tmp'.format(paths[name])
+                with open(tmp, 'wb') as f:
+                    np.save(f, values)
+                os.replace(tmp, paths[name])
+            with open(paths['json'], 'w') as f:
+                json.dump({'mtime_ns': mtime}, f)
+        except (IOError, OSError) as e:
+            logging.warning('Could not cache target map: {}'.format(e))
+
+    def lookup(self, values):
+        """
+        Ids for a Series of names, NaN where a name is not in the map.
+
+        :param values: pandas Series of names
+        :return: Series of ids on the same index
+        """
+        present = values.notna().to_numpy()
+        names = np.array([str(x).encode('utf-8') for x in values],
+                         dtype=bytes)
+        if not len(self.keys) or not len(names):
+            return pd.Series(np.nan, index=values.index)
+        pos = np.searchsorted(self.keys, names)
+        pos = np.minimum(pos, len(self.keys) - 1)
+        hit = present & (self.keys[pos] == names)
+        ids = np.asarray(self.ids[pos])
+        if not hit.all():
+            ids = np.where(hit, ids, np.nan)
+        return pd.Series(ids, index=values.index)
 
 
 class TargetConfig(object):
@@ -840,23 +1565,47 @@ class TargetConfig(object):
             params = self.target_dict[target_name]
             target = Target(target_name, target_dict=params, df=self.df)
             upload_df = target.format_target(upload_df)
-        upload_df = self.combine_target(upload_df, target_names, 'target_dict')
-        upload_df = self.combine_target(upload_df, negative_target_names,
-                                        'negative_target_dict')
-        upload_df = self.combine_target(upload_df, bid_adjust_names, 'bid_dict')
+        upload_df = self.combine_targets(upload_df, {
+            'target_dict': target_names,
+            'negative_target_dict': negative_target_names,
+            'bid_dict': bid_adjust_names})
         return upload_df
 
     @staticmethod
-    def combine_target(upload_df, target_names, col_name):
-        upload_df[col_name] = np.empty((len(upload_df), 0)).tolist()
-        for target_name in target_names:
-            upload_df.apply(lambda x: x[col_name].extend(x[target_name])
-                            if str(x[target_name]) != 'nan'
-                            else x[col_name], axis=1)
+    def combine_targets(upload_df, groups):
+        """
+        Concatenates each row's formatted target lists into one list
+        column per group, reading every target column once as a plain
+        list rather than applying per row.
+
+        :param upload_df: upload config with formatted target columns
+        :param groups: {combined column: [target columns]}
+        :return: upload_df with the combined columns set
+        """
+        columns = {}
+        for target_names in groups.values():
+            for target_name in target_names:
+                if target_name not in columns:
+                    columns[target_name] = upload_df[target_name].tolist()
+        for col_name, target_names in groups.items():
+            combined = [[] for _ in range(len(upload_df))]
+            for target_name in target_names:
+                for row, targets in zip(combined, columns[target_name]):
+                    if str(targets) != 'nan':
+                        row.extend(targets)
+            upload_df[col_name] = pd.Series(combined, index=upload_df.index,
+                                            dtype=object)
         return upload_df
 
+    @staticmethod
+    def combine_target(upload_df, target_names, col_name):
+        return TargetConfig.combine_targets(upload_df,
+                                            {col_name: target_names})
+
 
 class Target(object):
+    keyword_markup = str.maketrans('', '', '[]"')
+
     def __init__(self, target_type, fnc=None, map_file=None, df=None,
                  map_id='Criterion ID', map_name='Category', api_id='id',
                  api_name=None, target_file=None, target_dict=None):
@@ -906,28 +1655,36 @@ class Target(object):
                                  for x in target_map[t] if x and x != ['']]
         return target_map
 
+    @staticmethod
+    def parse_keyword(keyword):
+        """['MATCH_TYPE', 'text'] for a keyword cell: [exact] and
+        "phrase" markup set the match type, anything else is broad, and
+        an empty cell gives ['']."""
+        keyword = 'BROAD|' + keyword
+        if '[' in keyword:
+            keyword = keyword.replace('BROAD|', 'EXACT|')
+        if '"' in keyword:
+            keyword = keyword.replace('BROAD|', 'PHRASE|')
+        keyword = keyword.translate(Target.keyword_markup)
+        if keyword == 'BROAD|':
+            keyword = ''
+        return keyword.split('|')
+
     @staticmethod
     def format_keywords(df, cols):
+        keyword_config = {}
         for col in cols:
-            df[col] = 'BROAD|' + df[col]
-            for kw_t in [('[', 'EXACT|'), ('"', 'PHRASE|')]:
-                df[col] = np.where(df[col].str.contains(kw_t[0], regex=False),
-                                   df[col].str.replace('BROAD|', kw_t[1],
-                                                       regex=False), df[col])
-            for r in ['[', ']', '"']:
-                df[col] = df[col].str.replace(r, '', regex=False)
-            df[col] = df[col].replace('BROAD|', '', regex=False)
-            df[col] = df[col].str.split('|')
-        keyword_config = df[cols].to_dict(orient='list')
+            keyword_config[col] = [Target.parse_keyword(x)
+                                   for x in df[col].tolist()]
+            df[col] = pd.Series(keyword_config[col], index=df.index,
+                                dtype=object)
         return keyword_config
 
     @staticmethod
     def map_cols(df, cols, map_file, id_col, val_col):
-        vdf = pd.read_csv(map_file)
-        vdf = vdf[[val_col, id_col]].set_index(val_col)
-        vdf = vdf.to_dict(orient='dict')[id_col]
+        target_map = TargetMap.load(map_file, val_col, id_col)
         for col in cols:
-            df[col] = df[col].map(vdf)
+            df[col] = target_map.lookup(df[col])
         return df
 
     @staticmethod
@@ -1080,17 +1837,23 @@ class AdUpload(object):
     def upload_all_ads(self, api):
         cu = self.upload_all_creatives(api)
         total_ad = str(len(self.config))
-        results = []
-        for idx, ad_id in enumerate(self.config):
-            logging.info('Uploading ad {} of {}.  '
-                         'Ad Row: {}'.format(idx + 1, total_ad, ad_id + 2))
-            result = self.upload_ad(api, ad_id, cu)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[ad_id], self.snapshot_cols)
-            results.append(result)
+        api.plan_lookups(campaigns=_config_values(self.config, self.cam_name),
+                         ad_groups=_config_values(self.config, self.ag_name))
+        with api.batched():
+            results = utl.run_concurrent(
+                lambda x: self.upload_row(api, cu, total_ad, *x),
+                enumerate(self.config), api.upload_workers)
         logging.info('{} ads uploaded.'.format(total_ad))
         return results
 
+    def upload_row(self, api, cu, total_ad, idx, ad_id):
+        logging.info('Uploading ad {} of {}.  '
+                     'Ad Row: {}'.format(idx + 1, total_ad, ad_id + 2))
+        result = self.upload_ad(api, ad_id, cu)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[ad_id], self.snapshot_cols)
+        return result
+
     def upload_ad(self, api, ad_id, cu):
         ad = self.set_ad(ad_id)
         result = {
@@ -1106,9 +1869,7 @@ class AdUpload(object):
         if ad.check_exists(api, cu):
             result['status'] = 'skipped_exists'
             return result
-        r = api.create_ad(ad)
-        _populate_aw_result(result, r)
-        return result
+        return api.create_ad(ad, result)
 
 
 class Ad(object):
@@ -1143,9 +1904,21 @@ class Ad(object):
     def __eq__(self, other):
         return self.operand == other.operand
 
+    def source_values(self):
+        """Fields that rebuild this ad's operand through ``Ad(...)``,
+        which is how ``check_exists`` compares against ``ad_dict``."""
+        return {k: v for k, v in vars(self).items()
+                if k not in ('cu', 'ad_dict', 'operand', 'parent')}
+
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self.fingerprint())
+
+    def fingerprint(self):
+        return utl.fingerprint(self.operand)
+
     def set_media_id_from_ref(self):
         if self.image and self.cu and isinstance(self.image, dict):
             media_id = self.cu.media_id_for_reference(
@@ -1200,7 +1973,7 @@ class Ad(object):
 
     def check_exists(self, api, cu):
         self.set_operand(api)
-        if self in [Ad(api.ad_dict[x], cu) for x in api.ad_dict]:
+        if self.fingerprint() in api.ad_fingerprints(cu).get(self.parent, ()):
             logging.warning('Ad already in account and not uploaded.  '
                             'Operator as follows: \n {}.'.format(self.operand))
             return True
@@ -1234,15 +2007,22 @@ class CreativeUpload(utl.BaseCreativeStore):
     file_name = 'file_name'
     media_id = 'mediaId'
     reference_id = 'referenceId'
+    content_hash = 'contentHash'
     fn_col = file_name
-    id_cols = (media_id, reference_id)
+    id_cols = (media_id, reference_id, content_hash)
 
     def __init__(self, id_file_name='aw_creative_ids.csv',
                  creative_path='creative/'):
         super().__init__(id_file_name, creative_path)
 
     def _upload_one(self, api, file_path):
-        return api.upload_creative(file_path)
+        digest = _content_hash(file_path)
+        for rec in self.records.values():
+            if rec.get(self.content_hash) == digest and rec.get(self.media_id):
+                logging.info('{} matches an uploaded creative.  It was not '
+                             'uploaded again.'.format(file_path))
+                return dict(rec)
+        return api.upload_creative(file_path, digest)
 
     def media_id_for_reference(self, reference_id):
         """Reverse-resolve an asset's mediaId from its referenceId."""
@@ -4,15 +4,22 @@ import sys
 import json
 import time
 import logging
-import requests
+import threading
+import contextlib
 import pandas as pd
 import upload.utils as utl
-from requests_oauthlib import OAuth2Session
+from collections import OrderedDict
+from urllib.parse import urlencode, urlsplit
 
 dcm_path = 'dcm'
 config_path = os.path.join(utl.config_file_path, dcm_path)
+snapshot_file = os.path.join(config_path, 'snapshots.db')
 
 base_url = 'https://www.googleapis.com/dfareporting'
+batch_url = 'https://www.googleapis.com/batch/dfareporting'
+
+# CM360 accepts at most 100 calls per batch request.
+MAX_BATCH_SIZE = 100
 
 # Tracking ads need no creative — used for 1x1 placements whose tags
 # are trafficked into other platforms (FB/AW/Reddit).
@@ -57,6 +64,79 @@ def _multipart_related(metadata, media, boundary='lqapp_creative'):
     return b''.join(parts), 'multipart/related; boundary={}'.format(boundary)
 
 
+def _multipart_mixed(calls, boundary='lqapp_batch'):
+    """``(body, content_type)`` for a Google batch request: one
+    ``application/http`` part per ``(method, url, params, body)`` call,
+    tagged ``item<n>`` so the sub-responses can be matched back."""
+    parts = []
+    for idx, (method, url, params, body) in enumerate(calls):
+        path = urlsplit(url).path
+        if params:
+            path += '?' + urlencode(params)
+        request = '{} {} HTTP/1.1\r\n'.format(method.upper(), path)
+        if body is not None:
+            request += 'Content-Type: application/json; charset=UTF-8\r\n'
+        request += '\r\n'
+        if body is not None:
+            request += json.dumps(body)
+        parts.append(
+            '--{}\r\nContent-Type: application/http\r\n'
+            'Content-ID: <item{}>\r\n\r\n{}\r\n'.format(
+                boundary, idx, request))
+    parts.append('--{}--\r\n'.format(boundary))
+    body = ''.join(parts).encode()
+    return body, 'multipart/mixed; boundary={}'.format(boundary)
+
+
+class BatchPart(object):
+    """One sub-response of a batch request, shaped like the
+    ``requests`` response the result helpers read."""
+    __slots__ = ['status_code', 'text', 'headers']
+
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    @classmethod
+    def from_error(cls, error):
+        return cls(None, json.dumps({'error': {'message': str(error)}}))
+
+
+def _split_batch(response, count):
+    """The ``count`` sub-responses of a batch ``response``, in call
+    order. A refused batch (not multipart) answers every call with
+    itself, so each reads the refusal."""
+    content_type = response.headers.get('Content-Type', '')
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not boundary:
+        return [response] * count
+    parts = [BatchPart.from_error('No response for batched call')] * count
+    text = response.text.replace('\r\n', '\n')
+    for part in text.split('--' + boundary.group(1)):
+        head, _, message = part.strip('\n').partition('\n\n')
+        item = re.search(r'Content-ID:\s*<response-item(\d+)>', head, re.I)
+        status = re.match(r'HTTP/[\d.]+ (\d+)', message)
+        if not item or not status or int(item.group(1)) >= count:
+            continue
+        headers, _, body = message.partition('\n\n')
+        parts[int(item.group(1))] = BatchPart(
+            int(status.group(1)), body.strip(), dict(
+                x.split(':', 1) for x in headers.split('\n')[1:] if ':' in x))
+    return parts
+
+
+def _populate_dcm_twin(result, response):
+    """Fill a row queued twice in one batch from its lead's create:
+    the object the lead made already exists for the twin."""
+    _populate_dcm_result(result, response)
+    if result['status'] == 'created':
+        result['status'] = 'skipped_exists'
+
+
 def _fail_from_dcm(result, body, http_status=None):
     """Apply DCM's error envelope to a result."""
     err = body.get('error') or {}
@@ -99,8 +179,39 @@ def _to_dcm_date(col, value):
     return parsed.strftime('%Y-%m-%d')
 
 
+def _id_key(value):
+    """A DCM id as the one string the campaign caches are keyed by:
+    '' when missing, and a spreadsheet float like 123.0 as '123'."""
+    if value is None or str(value).strip() in ('', 'nan'):
+        return ''
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value).strip()
+    return str(int(number)) if number.is_integer() else str(value).strip()
+
+
+def _site_key(kind, value):
+    """Memo key for a site name or directory-site url, agreeing with
+    the exact-match lookups behind it: the stripped name, or for urls
+    the url without its scheme, since http and https are both tried."""
+    value = str(value or '').strip()
+    if kind == 'directorySites':
+        value = re.sub(r'^(https?:)?//', '', value)
+    return kind, value
+
+
 class DcApi(object):
     version = '5'
+    rate_limits = {'read': 10, 'write': 1, 'upload': 1}
+    # Listings DCM filters by campaign -> the attribute holding the one
+    # last used; every campaign's own copy lives in ``campaign_dicts``.
+    campaign_scoped = {'placement': 'place_dict', 'creative': 'creative_dict',
+                       'ad': 'ad_dict'}
+    # Account-wide listings a resolve phase can load up front.
+    account_scoped = {'campaign': 'cam_dict', 'landing_page': 'lp_dict',
+                      'site': 'site_dict'}
+    r = utl.ThreadLocalAttr()
 
     def __init__(self, config_file=None):
         self.config_file = config_file
@@ -114,6 +225,7 @@ class DcApi(object):
         self.report_id = None
         self.config_list = None
         self.client = None
+        self.token_manager = None
         self.lp_dict = {}
         self.site_dict = {}
         self.cam_dict = {}
@@ -122,7 +234,23 @@ class DcApi(object):
         self.ad_dict = {}
         self.creative_dict = {}
         self.directory_site_dict = {}
+        self.site_memo = {}
+        self.snapshots = utl.SnapshotStore(snapshot_file, dcm_path, None)
+        self.snapshot_scopes = {}
+        self.campaign_dicts = OrderedDict()
+        self.campaign_cache_size = 32
+        self.campaign_lock = threading.Lock()
+        self.resolve_workers = 4
+        self.tag_chunk_size = 0
+        self.batch_size = 1
+        self.batch_depth = 0
+        self.batch_lock = threading.Lock()
+        self.pending = []
+        self.pending_keys = {}
         self.df = pd.DataFrame()
+        self.upload_workers = utl.DEFAULT_WORKERS
+        self.limiter = utl.RateLimiter.from_config(self.rate_limits)
+        self.retry = utl.RetryPolicy(label='DCM')
         self.r = None
         if self.config_file:
             self.input_config(self.config_file)
@@ -152,6 +280,21 @@ class DcApi(object):
         self.usr_id = self.config['usr_id']
         self.config_list = [self.config, self.client_id, self.client_secret,
                             self.refresh_token, self.refresh_url, self.usr_id]
+        self.upload_workers = utl.config_workers(self.config)
+        self.campaign_cache_size = utl.config_int(
+            self.config, 'campaign_cache_size', 32)
+        self.resolve_workers = utl.config_workers(
+            self.config, key='resolve_workers', default=4)
+        self.tag_chunk_size = utl.config_int(
+            self.config, 'tag_chunk_size', 0, minimum=0)
+        self.batch_size = min(MAX_BATCH_SIZE, utl.config_int(
+            self.config, 'batch_size', 1))
+        self.snapshots = utl.SnapshotStore.from_config(
+            snapshot_file, dcm_path, self.usr_id, self.config)
+        self.limiter = utl.RateLimiter.from_config(
+            self.rate_limits, self.config)
+        self.retry = utl.RetryPolicy.from_config(self.config, label='DCM')
+        self.set_token_manager()
 
     def check_config(self):
         for item in self.config_list:
@@ -160,17 +303,22 @@ class DcApi(object):
                                 'Aborting.'.format(item))
                 sys.exit(0)
 
+    def set_token_manager(self):
+        """Token manager seeded with the configured access token. An
+        optional ``token_file`` (relative to ``config/dcm``) persists
+        the refreshed token and its expiry between runs."""
+        token_file = (self.config or {}).get('token_file')
+        if token_file:
+            token_file = os.path.join(config_path, token_file)
+        self.token_manager = utl.OAuthTokenManager(
+            self.client_id, self.client_secret, self.refresh_token,
+            self.refresh_url, access_token=self.access_token,
+            token_file=token_file)
+
     def get_client(self):
-        token = {'access_token': self.access_token,
-                 'refresh_token': self.refresh_token,
-                 'token_type': 'Bearer',
-                 'expires_in': 3600,
-                 'expires_at': 1504135205.73}
-        extra = {'client_id': self.client_id,
-                 'client_secret': self.client_secret}
-        self.client = OAuth2Session(self.client_id, token=token)
-        token = self.client.refresh_token(self.refresh_url, **extra)
-        self.client = OAuth2Session(self.client_id, token=token)
+        if not self.token_manager:
+            self.set_token_manager()
+        self.client = self.token_manager.get_session()
 
     def create_url(self, entity=None):
         vers_url = '/v{}'.format(self.version)
@@ -183,21 +331,18 @@ class DcApi(object):
     @staticmethod
     def get_id(dict_o, match, dict_two=None, match_two=None, parent_id=None,
                match_name='name', parent_name='parent'):
-        if parent_id:
-            id_list = [k for k, v in dict_o.items() if v[match_name] == match
-                       and str(v[parent_name]) == str(parent_id)]
-        else:
-            id_list = [k for k, v in dict_o.items() if v[match_name] == match]
+        id_list = utl.find_ids(dict_o, match, match_name, parent_id,
+                               parent_name)
         if dict_two is not None:
-            id_list = [k for k, v in dict_two.items() if v[match_name] == match_two
-                       and v[parent_name] == id_list[0]]
+            id_list = utl.find_ids(dict_two, match_two, match_name,
+                                   id_list[0], parent_name) if id_list else []
         return id_list
 
     def get_id_dict(self, entity=None, parent=None, fields=None, nest=None,
                     resp_entity=None, request_filter=None,
                     request_method='get'):
         url = self.create_url(entity)
-        id_dict = {}
+        id_dict = utl.IdDict()
         if request_filter:
             params = request_filter
         else:
@@ -207,7 +352,8 @@ class DcApi(object):
         while next_page:
             if next_page_token:
                 params['pageToken'] = next_page_token
-            r = self.make_request(url, method=request_method, params=params)
+            r = self.make_request(url, method=request_method, params=params,
+                                  create=False)
             id_dict = self.get_dict_from_page(
                 id_dict=id_dict, page=r.json(), parent=list(parent.values())[0],
                 fields=list(fields.values()), nest=nest, entity=resp_entity)
@@ -268,10 +414,12 @@ class DcApi(object):
                                       request_filter=request_filter)
         return place_dict
 
-    def get_tag_id_dict(self, campaign_id):
+    def get_tag_id_dict(self, campaign_id, placement_ids=None):
         parent = {'placementId': 'placementId'}
         fields = {'clickTag': 'clickTag'}
         request_filter = {'campaignId': campaign_id}
+        if placement_ids:
+            request_filter['placementIds'] = list(placement_ids)
         entity = 'placements/generatetags'
         place_dict = self.get_id_dict(
             entity=entity, parent=parent, fields=fields, nest='tagDatas',
@@ -317,43 +465,307 @@ class DcApi(object):
             entity='ads', parent=parent, fields=fields,
             resp_entity='ads', request_filter=request_filter)
 
+    def snapshot_id_dict(self, dict_attr, fetch, filter_id=None):
+        """``fetch``'s id dict through the snapshot store, scoped to
+        ``filter_id``. DCM lists can't filter on modified time, so a
+        stale snapshot is relisted in full."""
+        scope = str(filter_id or '')
+        self.snapshot_scopes[dict_attr] = scope
+        return self.snapshots.id_dict(dict_attr, fetch, scope=scope)
+
     def set_id_dict(self, dcm_object=None, filter_id=None):
         if dcm_object == 'landing_page':
-            self.lp_dict = self.get_lp_id_dict()
+            self.lp_dict = self.snapshot_id_dict(
+                'lp_dict', self.get_lp_id_dict)
         if dcm_object == 'campaign':
-            self.cam_dict = self.get_cam_id_dict()
-        if dcm_object == 'placement':
-            self.place_dict = self.get_place_id_dict(filter_id)
+            self.cam_dict = self.snapshot_id_dict(
+                'cam_dict', self.get_cam_id_dict)
+        if dcm_object in self.campaign_scoped:
+            self.campaign_dict(dcm_object, filter_id)
         if dcm_object == 'site':
-            self.site_dict = self.get_site_id_dict()
+            self.site_dict = self.snapshot_id_dict(
+                'site_dict', self.get_site_id_dict)
         if dcm_object == 'directorySites':
-            self.directory_site_dict = self.get_directory_site_id_dict(
+            self.directory_site_dict = self.snapshot_id_dict(
+                'directory_site_dict',
+                lambda: self.get_directory_site_id_dict(filter_id),
                 filter_id)
         if dcm_object == 'tags':
             self.tag_dict = self.get_tag_id_dict(filter_id)
-        if dcm_object == 'creative':
-            self.creative_dict = self.get_creative_id_dict(
-                campaign_id=filter_id)
-        if dcm_object == 'ad':
-            self.ad_dict = self.get_ad_id_dict(campaign_id=filter_id)
+
+    def list_campaign_dict(self, dcm_object, campaign_id):
+        fetch = {
+            'placement': lambda: self.get_place_id_dict(campaign_id),
+            'creative': lambda: self.get_creative_id_dict(
+                campaign_id=campaign_id),
+            'ad': lambda: self.get_ad_id_dict(campaign_id=campaign_id),
+        }[dcm_object]
+        return self.snapshots.id_dict(self.campaign_scoped[dcm_object],
+                                      fetch, scope=_id_key(campaign_id))
+
+    def campaign_dict(self, dcm_object, campaign_id):
+        """
+        The ``dcm_object`` listing of one campaign, from an LRU cache of
+        ``campaign_cache_size`` listings keyed by (object, campaign id),
+        so rows of a multi-campaign sheet each read their own campaign.
+        Listed on a miss. The dict also becomes ``place_dict`` /
+        ``creative_dict`` / ``ad_dict`` for callers of the old attrs.
+
+        :param dcm_object: 'placement', 'creative' or 'ad'
+        :param campaign_id: campaign the listing is filtered to
+        :return: IdDict
+        """
+        key = (dcm_object, _id_key(campaign_id))
+        with self.campaign_lock:
+            id_dict = self.campaign_dicts.get(key)
+            if id_dict is not None:
+                self.campaign_dicts.move_to_end(key)
+        if id_dict is None:
+            id_dict = self.list_campaign_dict(dcm_object, key[1] or None)
+            with self.campaign_lock:
+                self.campaign_dicts[key] = id_dict
+                while len(self.campaign_dicts) > self.campaign_cache_size:
+                    self.campaign_dicts.popitem(last=False)
+        dict_attr = self.campaign_scoped[dcm_object]
+        setattr(self, dict_attr, id_dict)
+        self.snapshot_scopes[dict_attr] = key[1]
+        return id_dict
+
+    def prefetch_campaigns(self, campaign_ids,
+                           dcm_objects=('placement', 'creative', 'ad')):
+        """
+        Lists ``dcm_objects`` for every campaign an upload config refers
+        to in one pass before its rows run, growing the cache to hold
+        them all, so each row's lookups are network-free.
+
+        :param campaign_ids: campaign ids used by the config
+        :param dcm_objects: listings to load per campaign
+        """
+        campaign_ids = [x for x in dict.fromkeys(
+            _id_key(x) for x in campaign_ids) if x]
+        keys = [(x, y) for x in campaign_ids for y in dcm_objects]
+        if len(keys) > self.campaign_cache_size:
+            self.campaign_cache_size = len(keys)
+        utl.run_concurrent(lambda x: self.campaign_dict(x[1], x[0]), keys,
+                           self.resolve_workers)
+
+    def resolve(self, dcm_objects):
+        """
+        Resolve phase of an upload: lists every account-wide collection
+        in ``dcm_objects`` not yet loaded, ``resolve_workers`` at a time,
+        so the rows built afterwards only read dicts.
+
+        :param dcm_objects: keys of ``account_scoped``, e.g. 'campaign'
+        """
+        pending = [x for x in dict.fromkeys(dcm_objects)
+                   if not isinstance(getattr(self, self.account_scoped[x]),
+                                     utl.IdDict)]
+        utl.run_concurrent(self.set_id_dict, pending, self.resolve_workers)
+
+    # Created entity -> (id dict attr, parent field, fields) as listed
+    # by the matching get_*_id_dict, for write-through of our creates.
+    created_dicts = {
+        'campaigns': ('cam_dict', 'advertiserId', ['id', 'name']),
+        'advertiserLandingPages': ('lp_dict', 'advertiserId', ['id', 'url']),
+        'placements': ('place_dict', 'campaignId',
+                       ['id', 'name', 'size', 'tagFormats']),
+        'sites': ('site_dict', 'accountId', ['id', 'name']),
+        'directorySites': ('directory_site_dict', 'advertiserId',
+                           ['id', 'url']),
+        'creatives': ('creative_dict', 'advertiserId', ['id', 'name']),
+        'ads': ('ad_dict', 'campaignId', ['id', 'name']),
+    }
+
+    def remember(self, entity_name, resp):
+        """Write a created entity through to its id dict, so later rows
+        in the same run find it without relisting. A dict that was never
+        listed is left alone; listing it picks the entity up anyway.
+
+        :param entity_name: the create endpoint, e.g. 'placements'
+        :param resp: the created resource DCM returned
+        """
+        if (entity_name not in self.created_dicts
+                or not isinstance(resp, dict) or 'id' not in resp):
+            return
+        dict_attr, parent, fields = self.created_dicts[entity_name]
+        id_dict = getattr(self, dict_attr)
+        scope = self.snapshot_scopes.get(dict_attr, '')
+        if parent == 'campaignId' and resp.get(parent):
+            dcm_object = next(k for k, v in self.campaign_scoped.items()
+                              if v == dict_attr)
+            scope = _id_key(resp[parent])
+            with self.campaign_lock:
+                id_dict = self.campaign_dicts.get((dcm_object, scope))
+        if not isinstance(id_dict, utl.IdDict):
+            return
+        rows = self.get_dict_from_page({}, {entity_name: [resp]}, parent,
+                                       fields, entity=entity_name)
+        id_dict.update(rows)
+        for k, row in rows.items():
+            self.snapshots.put(dict_attr, k, row, scope)
+
+    def memo_site(self, kind, value, find):
+        """
+        Id of the site (``kind`` 'sites') or directory site
+        ('directorySites') named ``value``, calling ``find`` only the
+        first time a normalised name or url is asked for. A miss is
+        memoised as None until ``remember_site`` records the create.
+
+        :param kind: 'sites' or 'directorySites'
+        :param value: site name or directory-site url
+        :param find: callable returning the id or None
+        :return: the site id or None
+        """
+        key = _site_key(kind, value)
+        if key not in self.site_memo:
+            self.site_memo[key] = find()
+        return self.site_memo[key]
+
+    def remember_site(self, kind, value, site_id):
+        self.site_memo[_site_key(kind, value)] = site_id
 
     def create_entity(self, entity, entity_name=''):
         url = self.create_url(entity_name)
         r = self.make_request(url, method='post', body=entity.upload_dict)
-        if 'error' in r.json():
+        self.created(entity, entity_name, r)
+        return r
+
+    def created(self, entity, entity_name, r):
+        body = utl.response_body(r)
+        if 'error' in body:
             msg = '{} not uploaded. \n Response: {} \n Body: {}'.format(
-                entity_name, r.json(), entity.upload_dict)
+                entity_name, body, entity.upload_dict)
             logging.warning(msg)
-        return r
+        else:
+            self.remember(entity_name, body)
+
+    @contextlib.contextmanager
+    def batched(self):
+        """Queue the creates ``submit_entity``-d inside the block into
+        batch requests of ``batch_size`` calls, sending whatever is
+        still queued on exit. Without a ``batch_size`` above one in the
+        config every object is sent on its own, as before."""
+        with self.batch_lock:
+            self.batch_depth += 1
+        try:
+            yield
+        finally:
+            with self.batch_lock:
+                self.batch_depth -= 1
+                last = not self.batch_depth
+            if last:
+                self.flush_entities()
+
+    def submit_entity(self, entity, entity_name, done, key=None,
+                      duplicate=None):
+        """Create one entity now, or queue it inside ``batched``.
+
+        :param entity: object whose ``upload_dict`` is posted
+        :param entity_name: the create endpoint, e.g. 'placements'
+        :param done: callable(response) for the outcome
+        :param key: identity of a create, so a twin queued in the same
+            batch resolves to the first instead of creating twice
+        :param duplicate: the twin's callable(response)
+        """
+        if not (self.batch_depth and self.batch_size > 1):
+            done(self.create_entity(entity, entity_name=entity_name))
+            return
+        with self.batch_lock:
+            if key and key in self.pending_keys:
+                self.pending_keys[key].append(duplicate or done)
+                return
+            if key:
+                self.pending_keys[key] = []
+            self.pending.append((entity, entity_name, key, done))
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush_entities()
+
+    def flush_entities(self):
+        """Send every queued create and hand each row, and any twins
+        of it, its own sub-response."""
+        with self.batch_lock:
+            queued, self.pending = self.pending, []
+        calls = [('post', self.create_url(x[1]), None, x[0].upload_dict)
+                 for x in queued]
+        for (entity, entity_name, key, done), r in zip(
+                queued, self.batch_requests(calls)):
+            self.created(entity, entity_name, r)
+            done(r)
+            with self.batch_lock:
+                followers = self.pending_keys.pop(key, []) if key else []
+            for follower in followers:
+                follower(r)
+
+    def batch_requests(self, calls):
+        """
+        Responses to ``(method, url, params, body)`` calls, in order,
+        sent ``batch_size`` per batch request. Only sub-calls answered
+        429 are resent, with backoff within the throttled budget — a
+        timeout or 5xx may follow a committed create. A batch that
+        can't be sent, or is refused whole, fails each of its calls.
+
+        :param calls: list of (method, url, params, body)
+        :return: one response per call
+        """
+        if self.batch_size <= 1:
+            return [self.request_or_error(*x) for x in calls]
+        responses = [None] * len(calls)
+        todo = list(range(len(calls)))
+        attempt = 0
+        while todo:
+            retry = []
+            for start in range(0, len(todo), self.batch_size):
+                chunk = todo[start:start + self.batch_size]
+                parts = self.send_batch([calls[x] for x in chunk])
+                for idx, part in zip(chunk, parts):
+                    responses[idx] = part
+                    if (isinstance(part, BatchPart)
+                            and part.status_code == 429 and attempt
+                            < self.retry.budgets.get('throttled', 0)):
+                        retry.append(idx)
+            todo = retry
+            if todo:
+                wait = self.retry.delay(attempt)
+                attempt += 1
+                logging.warning(f'DCM batch: resending {len(todo)} '
+                                f'calls in {wait:.1f}s.')
+                time.sleep(wait)
+        return responses
+
+    def request_or_error(self, method, url, params=None, body=None):
+        try:
+            return self.make_request(url, method, params, body)
+        except Exception as e:
+            return BatchPart.from_error(e)
 
-    def make_request(self, url, method, params=None, body=None):
-        self.get_client()
+    def send_batch(self, calls):
+        """One batch request for ``calls``; their sub-responses."""
         try:
-            self.r = self.raw_request(url, method, params, body)
-        except requests.exceptions.SSLError as e:
-            logging.warning('Warning SSLError as follows {}'.format(e))
-            time.sleep(30)
-            self.r = self.make_request(url, method, params, body)
+            self.get_client()
+            body, content_type = _multipart_mixed(calls)
+            r = self.retry.run_write(self.raw_batch, body, content_type)
+            return _split_batch(r, len(calls))
+        except Exception as e:
+            return [BatchPart.from_error(e)] * len(calls)
+
+    def raw_batch(self, body, content_type):
+        self.limiter.wait('write')
+        self.r = self.client.post(
+            '{}/v{}'.format(batch_url, self.version), data=body,
+            headers={'Content-Type': content_type})
+        return self.r
+
+    def make_request(self, url, method, params=None, body=None,
+                     create=None):
+        """Send one request under ``self.retry``. A create (any post
+        unless ``create`` says otherwise) is only resent when the
+        server can't have acted on it, so it is never made twice."""
+        self.get_client()
+        if create is None:
+            create = method == 'post'
+        run = self.retry.run_write if create else self.retry.run
+        self.r = run(self.raw_request, url, method, params, body)
         return self.r
 
     def get_account_id(self):
@@ -394,17 +806,10 @@ class DcApi(object):
             return [utl.fail_result(utl.new_update_result(pid), msg)
                     for pid in platform_ids]
         url = self.create_url('ads')
-        results = []
-        for pid in platform_ids:
-            result = utl.new_update_result(pid)
-            try:
-                _fail_if_refused(result, self.make_request(
-                    url, method='patch', params={'id': pid},
-                    body={'active': bool(activate)}))
-            except Exception as e:
-                utl.fail_result(result, e)
-            results.append(result)
-        return results
+        calls = [('patch', url, {'id': pid}, {'active': bool(activate)})
+                 for pid in platform_ids]
+        return [_fail_if_refused(utl.new_update_result(pid), r)
+                for pid, r in zip(platform_ids, self.batch_requests(calls))]
 
     update_segments_by_level = {'Campaign': 'campaigns',
                                 'Adset': 'placements'}
@@ -474,6 +879,7 @@ class DcApi(object):
     def raw_request(self, url, method, params=None, body=None):
         if not params:
             params = {}
+        self.limiter.wait('read' if method == 'get' else 'write')
         if body:
             if method == 'get':
                 self.r = self.client.get(url, params=params, json=body)
@@ -511,6 +917,7 @@ class DcApi(object):
         self.get_client()
         with open(file_path, 'rb') as f:
             body, content_type = _multipart_related(metadata, f.read())
+        self.limiter.wait('upload')
         r = self.client.post(
             url, data=body, headers={'Content-Type': content_type})
         try:
@@ -554,6 +961,7 @@ class DcApi(object):
                 'Creative {} not created. Response: {}'.format(
                     name, resp))
             return None
+        self.remember('creatives', resp)
         return resp['id']
 
 
@@ -591,20 +999,31 @@ class CampaignUpload(object):
         return cam
 
     def upload_all_campaigns(self, api):
+        """List the campaigns and landing pages once, build every
+        campaign in config order — building can create a missing shared
+        landing page — then push the campaigns themselves
+        ``api.upload_workers`` at a time."""
         total_camp = str(len(self.config))
-        results = []
-        for idx, c_id in enumerate(self.config):
-            logging.info('Uploading campaign {} of {}.  '
-                         'Campaign Name: {}'.format(idx + 1, total_camp, c_id))
-            result = self.upload_campaign(api, c_id)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[c_id], self.snapshot_cols)
-            results.append(result)
+        api.resolve(['campaign', 'landing_page'])
+        rows = [(idx, c_id, self.set_campaign(c_id, api))
+                for idx, c_id in enumerate(self.config)]
+        with api.batched():
+            results = utl.run_concurrent(
+                lambda x: self.upload_row(api, total_camp, *x), rows,
+                api.upload_workers)
         logging.info('Pausing for 30s while campaigns finish uploading.')
         return results
 
-    def upload_campaign(self, api, campaign_id):
-        campaign = self.set_campaign(campaign_id, api)
+    def upload_row(self, api, total_camp, idx, c_id, campaign):
+        logging.info('Uploading campaign {} of {}.  '
+                     'Campaign Name: {}'.format(idx + 1, total_camp, c_id))
+        result = self.upload_campaign(api, campaign)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[c_id], self.snapshot_cols)
+        return result
+
+    @staticmethod
+    def upload_campaign(api, campaign):
         result = {
             'source_name': campaign.name,
             'object_level': 'Campaign',
@@ -624,10 +1043,16 @@ class CampaignUpload(object):
             result['status'] = 'skipped_exists'
             result['platform_id'] = campaign.id
             return result
-        _populate_dcm_result(
-            result, api.create_entity(campaign, entity_name='campaigns'))
-        if result['status'] == 'created':
-            campaign.id = result['platform_id']
+
+        def done(r):
+            _populate_dcm_result(result, r)
+            if result['status'] == 'created':
+                campaign.id = result['platform_id']
+
+        api.submit_entity(
+            campaign, 'campaigns', done,
+            key=('campaigns', campaign.name, campaign.advertiserId),
+            duplicate=lambda r: _populate_dcm_twin(result, r))
         return result
 
 
@@ -814,42 +1239,71 @@ class PlacementUpload(object):
         return placement
 
     def upload_all_placements(self, api):
+        """List the campaigns and sites once, build every placement in
+        config order — building can create a missing shared site — load
+        each campaign's placements, then push the placements themselves
+        ``api.upload_workers`` at a time."""
         total_placements = str(len(self.config))
-        results = []
-        for idx, p_id in enumerate(self.config):
-            placement = self.set_placement(p_id, api)
-            logging.info('Uploading placement {} of {}.  '
-                         'Placement Name: {}'.format(idx + 1, total_placements,
-                                                     placement.name))
-            result = self.upload_placement(api, placement)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[p_id], self.snapshot_cols)
-            results.append(result)
+        api.resolve(['campaign', 'site'])
+        rows = [(idx, p_id, self.set_placement(p_id, api))
+                for idx, p_id in enumerate(self.config)]
+        api.prefetch_campaigns([x[2].campaignId for x in rows], ['placement'])
+        with api.batched():
+            results = utl.run_concurrent(
+                lambda x: self.upload_row(api, total_placements, *x), rows,
+                api.upload_workers)
         logging.info('Pausing for 30s while campaigns finish uploading.')
         self.attach_placement_tags(api, results)
         return results
 
+    def upload_row(self, api, total_placements, idx, p_id, placement):
+        logging.info('Uploading placement {} of {}.  '
+                     'Placement Name: {}'.format(idx + 1, total_placements,
+                                                 placement.name))
+        result = self.upload_placement(api, placement)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[p_id], self.snapshot_cols)
+        return result
+
     @staticmethod
     def attach_placement_tags(api, results):
         """Enrich each placement result with its DCM click tag.
 
         Tags are the artifact trafficking teams copy into other
         systems, so surface them on the run. Tags are fetched per
-        campaign (the API filters by campaignId); a fetch failure is
-        logged and skipped — tags are an enrichment, never block the
-        run results.
+        campaign (the API filters by campaignId), ``api.resolve_workers``
+        requests at a time; with ``tag_chunk_size`` set, a campaign's
+        placements are requested that many ids per call so one large
+        campaign is split across the workers. A fetch failure is logged
+        and skipped — tags are an enrichment, never block the run
+        results.
         """
-        campaign_ids = {r.get('parent_platform_id') for r in results
-                        if r.get('parent_platform_id')}
-        tags_by_placement = {}
-        for campaign_id in campaign_ids:
+        placements = {}
+        for r in results:
+            if r.get('parent_platform_id'):
+                ids = placements.setdefault(r['parent_platform_id'], [])
+                if r.get('platform_id'):
+                    ids.append(r['platform_id'])
+        size = api.tag_chunk_size
+        jobs = []
+        for campaign_id, ids in placements.items():
+            if not size or not ids:
+                jobs.append((campaign_id, None))
+                continue
+            jobs.extend((campaign_id, ids[x:x + size])
+                        for x in range(0, len(ids), size))
+
+        def fetch(job):
             try:
-                tag_dict = PlacementUpload.generate_dcm_tags(api, campaign_id)
+                return PlacementUpload.generate_dcm_tags(api, *job)
             except Exception as e:
                 logging.warning(
                     'Could not fetch DCM tags for campaign {}: {}'.format(
-                        campaign_id, e))
-                continue
+                        job[0], e))
+                return {}
+
+        tags_by_placement = {}
+        for tag_dict in utl.run_concurrent(fetch, jobs, api.resolve_workers):
             for placement_id, data in tag_dict.items():
                 tags_by_placement[str(placement_id)] = data.get('clickTag')
         for r in results:
@@ -885,28 +1339,31 @@ class PlacementUpload(object):
                 'missing from the upload file)'.format(placement.site))
             return result
         if placement.check_exists(api):
-            existing = api.get_id(api.place_dict, placement.name)
+            existing = api.get_id(
+                api.campaign_dict('placement', placement.campaignId),
+                placement.name)
             if existing:
                 result['platform_id'] = existing[0]
             result['status'] = 'skipped_exists'
             return result
-        _populate_dcm_result(
-            result,
-            api.create_entity(placement, entity_name='placements'))
+        api.submit_entity(
+            placement, 'placements', lambda r: _populate_dcm_result(result, r),
+            key=('placements', placement.name, _id_key(placement.campaignId)),
+            duplicate=lambda r: _populate_dcm_twin(result, r))
         return result
 
     @staticmethod
-    def generate_dcm_tags(api, campaign_id):
+    def generate_dcm_tags(api, campaign_id, placement_ids=None):
         """
         Grabs tags for placements with the specified campaign_id.  Returns as
-        a dictionary.
+        a dictionary of its own, so campaigns can be fetched concurrently.
 
         :param api: instance of authenticated DcApi
         :param campaign_id: id of the campaign to pull placements for
-        :return: api.tag_dict dictionary with tags and placement ids
+        :param placement_ids: only these placements of the campaign
+        :return: dictionary with tags and placement ids
         """
-        api.set_id_dict(dcm_object='tags', filter_id=campaign_id)
-        return api.tag_dict
+        return api.get_tag_id_dict(campaign_id, placement_ids)
 
 
 class Placement(object):
@@ -979,9 +1436,8 @@ class Placement(object):
                 'was not found in account); skipping existence '
                 'check and upload.'.format(self.name, self.campaign))
             return True
-        if not api.place_dict:
-            api.set_id_dict(dcm_object='placement', filter_id=self.campaignId)
-        pid = api.get_id(api.place_dict, self.name)
+        place_dict = api.campaign_dict('placement', self.campaignId)
+        pid = api.get_id(place_dict, self.name)
         if pid:
             logging.warning('{} already in account.  '
                             'This was not uploaded.'.format(self.name))
@@ -1022,25 +1478,28 @@ class DirectorySite(object):
         return site_dict
 
     def get_landing_page_id(self, api):
+        self.id = api.memo_site('directorySites', self.url,
+                                lambda: self.find_id(api))
+        if not self.id:
+            logging.info('Directory site does not exist. Uploading')
+            self.upload(api)
+
+    def find_id(self, api):
         api.set_id_dict('directorySites',
                         filter_id=self.url.replace('https:', ''))
         url_types = [self.url, self.url.replace('https', 'http')]
-        site_ids = []
         for url_type in url_types:
             site_ids = api.get_id(api.directory_site_dict, url_type,
                                   match_name='url')
             if site_ids:
-                break
-        if site_ids:
-            self.id = site_ids[0]
-        else:
-            logging.info('Directory site does not exist. Uploading')
-            self.upload(api)
+                return site_ids[0]
+        return None
 
     def upload(self, api):
         logging.info('Uploading directory site {}'.format(self.upload_dict))
         r = api.create_entity(self, entity_name='directorySites')
         self.id = r.json()['id']
+        api.remember_site('directorySites', self.url, self.id)
 
 
 class Site(object):
@@ -1062,21 +1521,26 @@ class Site(object):
         return site_dict
 
     def get_landing_page_id(self, api):
-        if not api.site_dict:
-            api.set_id_dict('site')
-        site_ids = api.get_id(api.site_dict, self.name)
-        if site_ids:
-            self.id = site_ids[0]
-        else:
+        self.id = api.memo_site('sites', self.name,
+                                lambda: self.find_id(api))
+        if not self.id:
             logging.info('Site does not exist. Uploading')
             self.upload(api)
 
+    def find_id(self, api):
+        # An IdDict was listed already, even if the account has no sites.
+        if not isinstance(api.site_dict, utl.IdDict):
+            api.set_id_dict('site')
+        site_ids = api.get_id(api.site_dict, self.name)
+        return site_ids[0] if site_ids else None
+
     def upload(self, api):
         logging.info('Uploading site with {}'.format(self.upload_dict))
         ds = DirectorySite(self.upload_dict, self.api)
         self.upload_dict['directorySiteId'] = ds.id
         r = api.create_entity(self, entity_name='sites')
         self.id = r.json()['id']
+        api.remember_site('sites', self.name, self.id)
 
 
 class AdUpload(object):
@@ -1155,31 +1619,53 @@ class AdUpload(object):
     def upload_all_ads(self, api):
         if not self.config:
             return []
+        api.resolve(['campaign'])
         cu = self.upload_all_creatives(api)
         total = len(self.config)
-        results = []
-        for idx, a_id in enumerate(self.config):
-            ad = self.set_ad(a_id, api)
-            if not ad.creativeId and ad.creative:
-                # Fresh creatives miss the campaign-scoped listing.
-                ad.creativeId = cu.get_id(str(ad.creative))
-                if ad.creativeId:
-                    ad.upload_dict = ad.create_ad_dict()
-            if (not ad.creativeId and not ad.is_tracking()
-                    and ad.campaignId and ad.placementIds
-                    and ad.placements_all_tracking(api)):
-                logging.info(
-                    'Creative %r not found and all placements are '
-                    '1x1/tracking - creating %r as tracking ad.',
-                    ad.creative, ad.name)
-                ad.convert_to_tracking()
+        api.prefetch_campaigns(self.campaign_ids(api))
+        rows = [(idx, a_id, self.resolve_ad(a_id, api, cu))
+                for idx, a_id in enumerate(self.config)]
+        with api.batched():
+            return utl.run_concurrent(
+                lambda x: self.upload_row(api, total, *x), rows,
+                api.upload_workers)
+
+    def campaign_ids(self, api):
+        """Ids of the campaigns this run's ads are named under."""
+        ids = []
+        for row in self.config.values():
+            cam = Campaign({'name': row.get(self.campaign)}, upload=False)
+            if cam.name:
+                cam.set_id(api)
+            ids.append(cam.id or row.get(self.campaignId))
+        return ids
+
+    def resolve_ad(self, a_id, api, cu):
+        """Build one ad and settle its creative — run in config order,
+        ahead of the concurrent push, because resolving fills the
+        campaign-scoped dicts every row reads."""
+        ad = self.set_ad(a_id, api)
+        if not ad.creativeId and ad.creative:
+            # Fresh creatives miss the campaign-scoped listing.
+            ad.creativeId = cu.get_id(str(ad.creative))
+            if ad.creativeId:
+                ad.upload_dict = ad.create_ad_dict()
+        if (not ad.creativeId and not ad.is_tracking()
+                and ad.campaignId and ad.placementIds
+                and ad.placements_all_tracking(api)):
             logging.info(
-                f'Uploading ad {idx + 1} of {total}. Ad Name: {ad.name}')
-            result = self.upload_ad(api, ad)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[a_id], self.snapshot_cols)
-            results.append(result)
-        return results
+                'Creative %r not found and all placements are '
+                '1x1/tracking - creating %r as tracking ad.',
+                ad.creative, ad.name)
+            ad.convert_to_tracking()
+        return ad
+
+    def upload_row(self, api, total, idx, a_id, ad):
+        logging.info(f'Uploading ad {idx + 1} of {total}. Ad Name: {ad.name}')
+        result = self.upload_ad(api, ad)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[a_id], self.snapshot_cols)
+        return result
 
     @staticmethod
     def upload_ad(api, ad):
@@ -1212,17 +1698,23 @@ class AdUpload(object):
                 f'ad was auto-created')
             return result
         if ad.check_exists(api):
-            existing = api.get_id(api.ad_dict, ad.name)
+            existing = api.get_id(api.campaign_dict('ad', ad.campaignId),
+                                  ad.name)
             if existing:
                 result['platform_id'] = existing[0]
             result['status'] = 'skipped_exists'
             return result
-        _populate_dcm_result(
-            result, api.create_entity(ad, entity_name='ads'))
-        if (result['status'] == 'created' and ad.is_tracking()
-                and not ad.creativeId):
-            result['error_message'] = (
-                'Created as tracking ad (no creative needed)')
+
+        def done(r):
+            _populate_dcm_result(result, r)
+            if (result['status'] == 'created' and ad.is_tracking()
+                    and not ad.creativeId):
+                result['error_message'] = (
+                    'Created as tracking ad (no creative needed)')
+
+        api.submit_entity(
+            ad, 'ads', done, key=('ads', ad.name, _id_key(ad.campaignId)),
+            duplicate=lambda r: _populate_dcm_twin(result, r))
         return result
 
 
@@ -1265,16 +1757,14 @@ class Ad(object):
             self.campaignId = cam.id
         if not self.campaignId:
             return
-        if not api.place_dict:
-            api.set_id_dict(dcm_object='placement',
-                            filter_id=self.campaignId)
+        place_dict = api.campaign_dict('placement', self.campaignId)
         # DCM convention: the ad is named after its placement.
         placement_names = [
             p.strip() for p in str(self.placement or self.name or '')
             .split('|') if p.strip()]
         self.placementIds = []
         for pname in placement_names:
-            pid = api.get_id(api.place_dict, pname)
+            pid = api.get_id(place_dict, pname)
             if pid:
                 self.placementIds.append(pid[0])
         if not self.placementIds and self.placementId:
@@ -1287,11 +1777,9 @@ class Ad(object):
                 except ValueError:
                     logging.warning(
                         f'{self.name}: bad placementId {p!r}')
-        if not api.creative_dict:
-            api.set_id_dict(dcm_object='creative',
-                            filter_id=self.campaignId)
         if self.creative:
-            cre = api.get_id(api.creative_dict, self.creative)
+            cre = api.get_id(
+                api.campaign_dict('creative', self.campaignId), self.creative)
             if cre:
                 self.creativeId = cre[0]
 
@@ -1318,8 +1806,9 @@ class Ad(object):
     def placements_all_tracking(self, api):
         if not self.placementIds:
             return False
+        place_dict = api.campaign_dict('placement', self.campaignId)
         return all(self._placement_is_tracking(
-            api.place_dict.get(pid) or {}) for pid in self.placementIds)
+            place_dict.get(pid) or {}) for pid in self.placementIds)
 
     def convert_to_tracking(self):
         self.type = TRACKING_AD_TYPE
@@ -1356,9 +1845,7 @@ class Ad(object):
     def check_exists(self, api):
         if not self.campaignId:
             return True
-        if not api.ad_dict:
-            api.set_id_dict(dcm_object='ad', filter_id=self.campaignId)
-        aid = api.get_id(api.ad_dict, self.name)
+        aid = api.get_id(api.campaign_dict('ad', self.campaignId), self.name)
         if aid:
             logging.warning(
                 f'{self.name} already in account. Not uploaded.')
@@ -1387,12 +1874,10 @@ class Creative(object):
             self.set_id(self.api)
 
     def set_id(self, api):
-        if not api.creative_dict:
-            api.set_id_dict(dcm_object='creative',
-                            filter_id=self.campaignId)
         if not self.name:
             return
-        cid = api.get_id(api.creative_dict, self.name)
+        cid = api.get_id(api.campaign_dict('creative', self.campaignId),
+                         self.name)
         if cid:
             self.id = cid[0]
 
@@ -1,13 +1,16 @@
 import os
 import sys
+import copy
 import time
 import json
 import pytz
 import logging
-import itertools
+import threading
+import contextlib
 import numpy as np
 import pandas as pd
 import datetime as dt
+from collections import namedtuple
 import decimal
 import upload.utils as utl
 from facebook_business.adobjects.ad import Ad
@@ -31,12 +34,88 @@ from facebook_business.adobjects.adcreativevideodata \
 
 fb_path = 'fb'
 config_path = os.path.join(utl.config_file_path, fb_path)
+snapshot_file = os.path.join(config_path, 'snapshots.db')
 log = logging.getLogger()
 
+# Compact id-dict rows: the lookups only ever read these fields, so the
+# SDK objects are dropped as each page of the listing is read.
+CampaignRecord = namedtuple('CampaignRecord', ['id', 'name'])
+AdSetRecord = namedtuple('AdSetRecord', ['id', 'name', 'campaign_id'])
+AdRecord = namedtuple('AdRecord', ['id', 'name', 'campaign_id', 'adset_id'])
+
+# Graph accepts at most 50 calls per batch request.
+MAX_BATCH_SIZE = 50
+
+
+class BatchCall(object):
+    """A create or update queued for a Graph batch request.
+
+    ``outcome`` is the caller's result dict, filled in place once the
+    call's sub-response comes back. ``followers`` are outcomes of
+    duplicate creates of the same object, resolved from this one
+    instead of creating the object twice.
+    """
+    __slots__ = ['call', 'params', 'outcome', 'on_success', 'key',
+                 'followers', 'tries', 'done']
+
+    def __init__(self, call, params, outcome, on_success=None, key=None):
+        self.call = call
+        self.params = params
+        self.outcome = outcome
+        self.on_success = on_success
+        self.key = key
+        self.followers = []
+        self.tries = 0
+        self.done = False
+
+    def follow(self, outcome):
+        """Resolve a duplicate's outcome from this finished call."""
+        if self.outcome.get('status') == 'created':
+            outcome.update({'status': 'skipped_exists',
+                            'platform_id': self.outcome.get('platform_id'),
+                            'error_code': None, 'error_message': None})
+        else:
+            outcome.update({'status': 'failed', 'platform_id': None,
+                            'error_code': self.outcome.get('error_code'),
+                            'error_message': self.outcome.get(
+                                'error_message')})
+
+
+class RateLimitedAdsApi(FacebookAdsApi):
+    """FacebookAdsApi that paces every Graph call through ``limiter``.
+
+    Installed as the SDK default api by ``FbApi.input_config``, so every
+    ``remote_create``/``api_get``/``get_*`` and batch execute passes
+    through ``call`` here.
+    """
+    limiter = None
+    upload_edges = ('adimages', 'advideos')
+
+    def endpoint_class(self, method, path, files=None):
+        edge = path[-1] if isinstance(path, (list, tuple)) and path else path
+        if files or str(edge).rstrip('/').endswith(self.upload_edges):
+            return 'upload'
+        if str(method).upper() == 'GET':
+            return 'read'
+        return 'write'
+
+    def call(self, method, path, params=None, headers=None, files=None,
+             url_override=None, api_version=None):
+        if self.limiter:
+            self.limiter.wait(self.endpoint_class(method, path, files))
+        return super(RateLimitedAdsApi, self).call(
+            method, path, params=params, headers=headers, files=files,
+            url_override=url_override, api_version=api_version)
+
 
 class FbApi(object):
     saved_audience = 'savedaudience'
     custom_audience = 'customaudience'
+    rate_limits = {'read': 20, 'write': 10, 'upload': 2}
+    retry_budgets = {'throttled': 8, 'transient': 5, 'other': 2, 'ssl': 5,
+                     'connection': 5, 'server': 3}
+    throttle_codes = (4, 17, 32, 613, 80000, 80001, 80002, 80003, 80004,
+                      80005, 80006, 80008, 80009, 80014)
 
     def __init__(self, config_file=None):
         self.config_file = config_file
@@ -55,6 +134,18 @@ class FbApi(object):
         self.cam_dict = None
         self.ad_dict = None
         self.pixel = None
+        self.snapshots = utl.SnapshotStore(snapshot_file, fb_path, None)
+        self.snapshot_scopes = {}
+        self.upload_workers = utl.DEFAULT_WORKERS
+        self.batch_size = 1
+        self.batch_depth = 0
+        self.batch_lock = threading.Lock()
+        self.pending = []
+        self.pending_keys = {}
+        self.limiter = utl.RateLimiter.from_config(self.rate_limits)
+        self.retry = utl.RetryPolicy(
+            self.retry_budgets, classify=self.classify_error, base_delay=2.0,
+            max_delay=300.0, label='Facebook')
         if self.config_file:
             self.input_config(self.config_file)
         self.tz = self.timezone_check()
@@ -64,7 +155,9 @@ class FbApi(object):
         self.config_file = os.path.join(config_path, config_file)
         self.load_config()
         self.check_config()
-        FacebookAdsApi.init(self.app_id, self.app_secret, self.access_token)
+        api = RateLimitedAdsApi.init(
+            self.app_id, self.app_secret, self.access_token)
+        api.limiter = self.limiter
         self.account = AdAccount(self.config['act_id'])
 
     def load_config(self):
@@ -80,6 +173,17 @@ class FbApi(object):
         self.act_id = self.config['act_id']
         self.config_list = [self.app_id, self.app_secret, self.access_token,
                             self.act_id]
+        self.upload_workers = utl.config_workers(self.config)
+        self.batch_size = min(MAX_BATCH_SIZE, utl.config_int(
+            self.config, 'batch_size', 1))
+        self.snapshots = utl.SnapshotStore.from_config(
+            snapshot_file, fb_path, self.act_id, self.config)
+        self.limiter = utl.RateLimiter.from_config(
+            self.rate_limits, self.config)
+        self.retry = utl.RetryPolicy.from_config(
+            self.config, budgets=self.retry_budgets,
+            classify=self.classify_error, base_delay=2.0, max_delay=300.0,
+            label='Facebook')
 
     def check_config(self):
         for item in self.config_list:
@@ -120,22 +224,179 @@ class FbApi(object):
         fb_object = self.fb_objects_by_level.get(object_level)
         status = 'ACTIVE' if activate else 'PAUSED'
         results = []
-        for pid in platform_ids:
-            result = utl.new_update_result(pid)
-            if not fb_object:
-                results.append(utl.fail_result(
-                    result, f'Unknown Facebook level: {object_level}'))
-                continue
-            try:
-                fb_object(str(pid)).api_update(params={'status': status})
-            except FacebookRequestError as e:
-                utl.fail_result(result, e.api_error_message(),
-                                e.api_error_code())
-            except Exception as e:
-                utl.fail_result(result, e)
-            results.append(result)
+        with self.batched():
+            for pid in platform_ids:
+                result = utl.new_update_result(pid)
+                if not fb_object:
+                    results.append(utl.fail_result(
+                        result, f'Unknown Facebook level: {object_level}'))
+                    continue
+                try:
+                    self.submit(fb_object(str(pid)).api_update,
+                                {'status': status}, result)
+                except Exception as e:
+                    utl.fail_result(result, e)
+                results.append(result)
         return results
 
+    @contextlib.contextmanager
+    def batched(self):
+        """Queue the creates and updates ``submit``-ted inside the
+        block into Graph batch requests of ``batch_size`` calls, sending
+        whatever is still queued on exit. Without a ``batch_size`` above
+        one in the config every call is sent on its own, as before."""
+        with self.batch_lock:
+            self.batch_depth += 1
+        try:
+            yield
+        finally:
+            with self.batch_lock:
+                self.batch_depth -= 1
+                last = not self.batch_depth
+            if last:
+                self.flush_batch()
+
+    def submit(self, call, params, outcome, on_success=None, key=None,
+               retry=False):
+        """Send one create/update now, or queue it for a batch request
+        inside ``batched``. ``outcome`` is filled in place either way:
+        failed with the Graph error, or passed with the created object
+        (or response body) to ``on_success``.
+
+        :param call: bound SDK method taking ``params`` (and ``batch``)
+        :param params: the call's params
+        :param outcome: result dict to fill
+        :param on_success: callable(outcome, created) on success
+        :param key: identity of a create, so duplicates queued in the
+            same batch resolve to the first instead of creating twice
+        :param retry: retry a direct call under ``self.retry``
+        :returns: outcome
+        """
+        if self.batch_depth and self.batch_size > 1:
+            with self.batch_lock:
+                lead = self.pending_keys.get(key) if key else None
+                if lead:
+                    if lead.done:
+                        lead.follow(outcome)
+                    else:
+                        lead.followers.append(outcome)
+                    return outcome
+                batch_call = BatchCall(call, params, outcome, on_success, key)
+                self.pending.append(batch_call)
+                if key:
+                    self.pending_keys[key] = batch_call
+                full = len(self.pending) >= self.batch_size
+            if full:
+                self.flush_batch()
+            return outcome
+        try:
+            if retry:
+                created = self.retry.run(call, params=params)
+            else:
+                created = call(params=params)
+        except FacebookRequestError as e:
+            return utl.fail_result(outcome, e.api_error_message(),
+                                   e.api_error_code())
+        if on_success:
+            on_success(outcome, created)
+        return outcome
+
+    def flush_batch(self):
+        """Send every queued call, ``batch_size`` per request, and
+        resend the throttled or unanswered ones with backoff."""
+        with self.batch_lock:
+            calls, self.pending = self.pending, []
+        attempt = 0
+        while calls:
+            retry = []
+            for start in range(0, len(calls), self.batch_size):
+                self.execute_batch(calls[start:start + self.batch_size],
+                                   retry)
+            calls = retry
+            if calls:
+                wait = self.retry.delay(attempt)
+                attempt += 1
+                logging.warning(f'Facebook batch: resending {len(calls)} '
+                                f'calls in {wait:.1f}s.')
+                time.sleep(wait)
+
+    def execute_batch(self, calls, retry):
+        """One Graph batch request for ``calls``. Each sub-response
+        fills its call's outcome; throttled, transient or unanswered
+        calls within budget are appended to ``retry``."""
+        batch = FacebookAdsApi.get_default_api().new_batch()
+        answered = set()
+
+        def success(call, response):
+            answered.add(id(call))
+            self.finish_call(call, created=response.json())
+
+        def failure(call, response):
+            answered.add(id(call))
+            error = response.error()
+            call.tries += 1
+            error_class = self.classify_error(error)
+            if (error_class in ('throttled', 'transient')
+                    and call.tries <= self.retry.budgets.get(error_class, 0)):
+                retry.append(call)
+                return
+            self.finish_call(call, error=error)
+
+        for call in calls:
+            call.call(params=call.params, batch=batch,
+                      success=lambda r, c=call: success(c, r),
+                      failure=lambda r, c=call: failure(c, r))
+        try:
+            self.retry.run(batch.execute)
+        except Exception as e:
+            for call in calls:
+                if id(call) not in answered:
+                    self.finish_call(call, error=e)
+            return
+        for call in calls:
+            if id(call) in answered:
+                continue
+            call.tries += 1
+            if call.tries <= self.retry.budgets.get('transient', 0):
+                retry.append(call)
+            else:
+                self.finish_call(call, error=Exception(
+                    'No response from Facebook batch request'))
+
+    def finish_call(self, call, created=None, error=None):
+        """Fill a batched call's outcome and those of its duplicates."""
+        if isinstance(error, FacebookRequestError):
+            utl.fail_result(call.outcome, error.api_error_message(),
+                            error.api_error_code())
+        elif error is not None:
+            utl.fail_result(call.outcome, error)
+        elif call.on_success:
+            call.on_success(call.outcome, created)
+        with self.batch_lock:
+            call.done = True
+            for outcome in call.followers:
+                call.follow(outcome)
+            if call.key and self.pending_keys.get(call.key) is call:
+                del self.pending_keys[call.key]
+
+    def fill_created(self, outcome, created, dict_attr, record):
+        """Mark a create's outcome created and write the new object
+        through to ``dict_attr``.
+
+        :param outcome: the create's result dict
+        :param created: the created SDK object or batch response body
+        :param dict_attr: id dict the object belongs in
+        :param record: callable building the id dict row from the id
+        """
+        if created is None:
+            utl.fail_result(outcome, 'Unknown error from Facebook')
+            return
+        platform_id = created.get('id')
+        outcome.update({'status': 'created', 'platform_id': platform_id,
+                        'error_code': None, 'error_message': None})
+        if platform_id:
+            self.remember(dict_attr, record(platform_id))
+
     def update_object(self, object_level, platform_id, changes,
                       context=None):
         """Push whitelisted field edits to one existing object.
@@ -235,71 +496,112 @@ class FbApi(object):
             return {field: '{} {}'.format(v, self.tz)}
         return {field: str(value)}
 
+    @staticmethod
+    def to_id_dict(fb_objects, record):
+        """Reduce an SDK cursor to ``record`` rows keyed by id.
+
+        :param fb_objects: iterable of SDK objects (pages load lazily)
+        :param record: namedtuple class naming the fields to keep
+        :returns: utl.IdDict of id -> record
+        """
+        return utl.IdDict(
+            (x['id'], record(*(x.get(f) for f in record._fields)))
+            for x in fb_objects)
+
+    id_dict_attrs = {Campaign: 'cam_dict', AdSet: 'adset_dict',
+                     Ad: 'ad_dict'}
+    # id dict attr -> (AdAccount list edge, record, parent filter field)
+    id_dict_specs = {
+        'cam_dict': ('get_campaigns', CampaignRecord, None),
+        'adset_dict': ('get_ad_sets', AdSetRecord, 'campaign.id'),
+        'ad_dict': ('get_ads', AdRecord, 'adset.id'),
+    }
+
+    def list_id_dict(self, dict_attr, parent_ids=None, since=None):
+        """List one level into an id dict, optionally limited to
+        ``parent_ids`` and to objects updated after ``since``."""
+        edge, record, parent_field = self.id_dict_specs[dict_attr]
+        filtering = []
+        if parent_ids:
+            filtering.append({"field": parent_field, "operator": "IN",
+                              "value": parent_ids})
+        if since:
+            filtering.append({"field": "updated_time",
+                              "operator": "GREATER_THAN",
+                              "value": int(since)})
+        params = {"filtering": filtering} if filtering else None
+        return self.to_id_dict(getattr(self.account, edge)(
+            fields=record._fields, params=params), record)
+
     def set_id_name_dict(self, fb_object, parent_ids=None):
+        dict_attr = self.id_dict_attrs.get(fb_object)
+        if not dict_attr:
+            return
         if not self.has_account():
             logging.warning('No Facebook ad-account id configured.  '
                             'Skipping object lookup.')
-            dict_attr = {Campaign: 'cam_dict', AdSet: 'adset_dict',
-                         Ad: 'ad_dict'}.get(fb_object)
-            if dict_attr:
-                setattr(self, dict_attr, [])
+            setattr(self, dict_attr, utl.IdDict())
             return
-        if fb_object == Campaign:
-            fields = ['id', 'name']
-            self.cam_dict = list(self.account.get_campaigns(fields=fields))
-        elif fb_object == AdSet:
-            params = None
-            if parent_ids:
-                params = {
-                    "filtering": [{
-                        "field": "campaign.id",
-                        "operator": "IN",
-                        "value": parent_ids,
-                    }]
-                }
-            fields = ['id', 'name', 'campaign_id']
-            self.adset_dict = list(self.account.get_ad_sets(
-                fields=fields, params=params))
-        elif fb_object == Ad:
-            params = None
-            if parent_ids:
-                params = {
-                    "filtering": [{
-                        "field": "adset.id",
-                        "operator": "IN",
-                        "value": parent_ids,
-                    }]
-                }
-            fields = ['id', 'name', 'campaign_id', 'adset_id']
-            self.ad_dict = list(self.account.get_ads(
-                fields=fields, params=params))
+        record = self.id_dict_specs[dict_attr][1]
+        scope = ','.join(sorted(str(x) for x in parent_ids or []))
+        self.snapshot_scopes[dict_attr] = scope
+        setattr(self, dict_attr, self.snapshots.id_dict(
+            dict_attr, lambda: self.list_id_dict(dict_attr, parent_ids),
+            scope=scope,
+            refresh=lambda since, _: self.list_id_dict(
+                dict_attr, parent_ids, since),
+            decode=lambda x: record(**x)))
+
+    def remember(self, dict_attr, record):
+        """Write a newly created object through to its id dict, so
+        later rows in the same run find it without relisting. A dict
+        that was never listed is left alone; listing it picks the
+        object up anyway.
+
+        :param dict_attr: 'cam_dict', 'adset_dict' or 'ad_dict'
+        :param record: the object's CampaignRecord/AdSetRecord/AdRecord
+        """
+        id_dict = getattr(self, dict_attr)
+        if record.id and id_dict is not None:
+            id_dict[record.id] = record
+            self.snapshots.put(dict_attr, record.id, record,
+                               self.snapshot_scopes.get(dict_attr, ''))
 
     def campaign_to_id(self, campaigns):
         if not self.cam_dict:
             self.set_id_name_dict(Campaign)
-        cids = [x['id'] for x in self.cam_dict if x['name'] in campaigns]
+        cids = [cid for name in dict.fromkeys(campaigns)
+                for cid in self.cam_dict.find(name)]
         return cids
 
+    def find_adset(self, adset_name, cid):
+        return self.adset_dict.find(adset_name, parent_id=cid,
+                                    parent_name='campaign_id')
+
+    def find_ad(self, ad_name, asid):
+        return self.ad_dict.find(ad_name, parent_id=(asid[1], asid[0]),
+                                 parent_name=('campaign_id', 'adset_id'))
+
     def adset_to_id(self, adsets, cids):
-        as_and_cam = list(itertools.product(adsets, cids))
         if not self.adset_dict:
             self.set_id_name_dict(AdSet, parent_ids=cids)
-        asids = [tuple([x['id'], x['campaign_id']]) for x in self.adset_dict
-                 if tuple([x['name'], x['campaign_id']]) in as_and_cam]
+        asids = [(asid, cid) for name in dict.fromkeys(adsets)
+                 for cid in dict.fromkeys(cids)
+                 for asid in self.find_adset(name, cid)]
         return asids
 
     def create_campaign(self, campaign_name, objective, status, spend_cap):
         if not self.cam_dict:
             self.set_id_name_dict(Campaign)
-        existing = [x for x in self.cam_dict if x['name'] == campaign_name]
+        existing = self.cam_dict.find(campaign_name)
         if existing:
             logging.warning(campaign_name + ' already in account.  This ' +
                             'campaign was not uploaded.')
             return {'status': 'skipped_exists',
-                    'platform_id': existing[0].get('id'),
+                    'platform_id': existing[0],
                     'error_code': None, 'error_message': None}
-        self.campaign = Campaign(parent_id=self.account.get_id_assured())
-        self.campaign.update({
+        campaign = Campaign(parent_id=self.account.get_id_assured())
+        campaign.update({
             Campaign.Field.name: campaign_name,
             Campaign.Field.objective: objective,
             Campaign.Field.status: status,
@@ -308,13 +610,16 @@ class FbApi(object):
             Campaign.Field.is_adset_budget_sharing_enabled: False,
         })
         try:
-            self.campaign.remote_create()
+            campaign.remote_create()
         except FacebookRequestError as e:
             return {'status': 'failed', 'platform_id': None,
                     'error_code': str(e.api_error_code() or '') or None,
                     'error_message': e.api_error_message()}
+        self.campaign = campaign
+        self.remember('cam_dict',
+                      CampaignRecord(campaign.get_id(), campaign_name))
         return {'status': 'created',
-                'platform_id': self.campaign.get_id(),
+                'platform_id': campaign.get_id(),
                 'error_code': None, 'error_message': None}
 
     @staticmethod
@@ -547,16 +852,14 @@ class FbApi(object):
             self.set_id_name_dict(AdSet, parent_ids=cids)
         outcomes = []
         for cid in cids:
-            existing = [x for x in self.adset_dict
-                        if x['name'] == adset_name
-                        and x['campaign_id'] == cid]
+            existing = self.find_adset(adset_name, cid)
             if existing:
                 msg = '{} already in campaign.  Adset was not uploaded.'.format(
                     adset_name)
                 logging.warning(msg)
                 outcomes.append({
                     'status': 'skipped_exists',
-                    'platform_id': existing[0].get('id'),
+                    'platform_id': existing[0],
                     'parent_platform_id': cid,
                     'error_code': None, 'error_message': None})
                 continue
@@ -633,20 +936,15 @@ class FbApi(object):
                 params[AdSet.Field.daily_budget] = int(bud_val)
             elif bud_type == 'lifetime':
                 params[AdSet.Field.lifetime_budget] = int(bud_val)
-            try:
-                created = self.account.create_ad_set(params=params)
-            except FacebookRequestError as e:
-                outcomes.append({
-                    'status': 'failed', 'platform_id': None,
-                    'parent_platform_id': cid,
-                    'error_code': str(e.api_error_code() or '') or None,
-                    'error_message': e.api_error_message()})
-                continue
-            outcomes.append({
-                'status': 'created',
-                'platform_id': created.get('id') if created else None,
-                'parent_platform_id': cid,
-                'error_code': None, 'error_message': None})
+            outcome = {'status': None, 'platform_id': None,
+                       'parent_platform_id': cid,
+                       'error_code': None, 'error_message': None}
+            outcomes.append(self.submit(
+                self.account.create_ad_set, params, outcome,
+                on_success=lambda o, created, cid=cid: self.fill_created(
+                    o, created, 'adset_dict',
+                    lambda x: AdSetRecord(x, adset_name, cid)),
+                key=('adset', adset_name, cid)))
         return outcomes
 
     def upload_creative(self, creative_class, image_path):
@@ -670,17 +968,30 @@ class FbApi(object):
         creative_hash = hash_function()
         return creative_hash
 
+    @staticmethod
+    def no_thumbnails(outcome):
+        """Retry classifier for ``get_all_thumbnails``: an empty list
+        means the video is still processing."""
+        if isinstance(outcome, BaseException):
+            return utl.classify_http_error(outcome)
+        return None if outcome else 'empty'
+
     def get_all_thumbnails(self, vid):
         video = AdVideo(vid)
-        thumbnails = video.get_thumbnails()
+        retry = utl.RetryPolicy(
+            {'empty': 10, 'connection': 5, 'ssl': 5},
+            classify=self.no_thumbnails, base_delay=15.0, max_delay=120.0,
+            label='Thumbnails for vid {}'.format(vid))
+        thumbnails = retry.run(video.get_thumbnails)
         if not thumbnails:
             logging.warning('Could not retrieve thumbnail for vid: ' +
-                            str(vid) + '.  Retrying in 120s.')
-            thumbnails = self.get_all_thumbnails(vid)
+                            str(vid) + '.')
         return thumbnails
 
     def get_video_thumbnail(self, vid):
         thumbnails = self.get_all_thumbnails(vid)
+        if not thumbnails:
+            return None
         thumbnail = [x for x in thumbnails if x['is_preferred'] is True]
         if not thumbnail:
             thumbnail = thumbnails[1]
@@ -689,35 +1000,36 @@ class FbApi(object):
         thumb_url = thumbnail['uri']
         return thumb_url
 
-    @staticmethod
-    def request_error(e):
-        continue_running = True
-        if e._api_error_code == 2:
-            logging.warning('Retrying as the call resulted in the following: '
-                            + str(e))
-        elif e._api_error_code == 100:
-            logging.warning('Error: {}'.format(e))
-            continue_running = False
-        else:
-            logging.error('Retrying in 120 seconds as the Facebook API call'
-                          'resulted in the following error: ' + str(e))
-        return continue_running
+    @classmethod
+    def classify_error(cls, outcome):
+        """Retry classifier for Graph calls: invalid parameters (100)
+        are final, rate-limit codes are ``throttled``, codes 1/2 and
+        errors the SDK flags transient are ``transient``, and anything
+        else gets the small ``other`` budget."""
+        if not isinstance(outcome, FacebookRequestError):
+            return utl.classify_http_error(outcome)
+        code = outcome.api_error_code()
+        if code == 100:
+            logging.warning('Error: {}'.format(outcome))
+            return None
+        if code in cls.throttle_codes:
+            return 'throttled'
+        if code in (1, 2) or outcome.api_transient_error():
+            return 'transient'
+        return 'other'
 
     def create_ad(self, ad_name, asids, title, body, desc, cta, durl, url,
                   prom_obj, ig_id, view_tag, ad_status, creative_hash=None,
                   vid_id=None):
         outcomes = []
         for asid in asids:
-            existing = [x for x in self.ad_dict
-                        if x['name'] == ad_name
-                        and x['campaign_id'] == asid[1]
-                        and x['adset_id'] == asid[0]]
+            existing = self.find_ad(ad_name, asid)
             if existing:
                 logging.warning(ad_name + ' already in campaign/adset. ' +
                                 'This ad was not uploaded.')
                 outcomes.append({
                     'status': 'skipped_exists',
-                    'platform_id': existing[0].get('id'),
+                    'platform_id': existing[0],
                     'parent_platform_id': asid[0],
                     'error_code': None, 'error_message': None})
                 continue
@@ -739,33 +1051,15 @@ class FbApi(object):
                                                  creative_hash, view_tag,
                                                  ad_status)
             params['contextual_multi_ads'] = {'enroll_status': 'OPT_OUT'}
-            created = None
-            last_err = None
-            for attempt_number in range(100):
-                try:
-                    created = self.account.create_ad(params=params)
-                    break
-                except FacebookRequestError as e:
-                    last_err = e
-                    continue_running = self.request_error(e)
-                    if not continue_running:
-                        break
-            if created is not None:
-                outcomes.append({
-                    'status': 'created',
-                    'platform_id': created.get('id') if created else None,
-                    'parent_platform_id': asid[0],
-                    'error_code': None, 'error_message': None})
-            else:
-                outcomes.append({
-                    'status': 'failed', 'platform_id': None,
-                    'parent_platform_id': asid[0],
-                    'error_code': (
-                                      str(last_err.api_error_code() or '')
-                                      if last_err else None) or None,
-                    'error_message': (
-                        last_err.api_error_message()
-                        if last_err else 'Unknown error from Facebook')})
+            outcome = {'status': None, 'platform_id': None,
+                       'parent_platform_id': asid[0],
+                       'error_code': None, 'error_message': None}
+            outcomes.append(self.submit(
+                self.account.create_ad, params, outcome,
+                on_success=lambda o, created, asid=asid: self.fill_created(
+                    o, created, 'ad_dict',
+                    lambda x: AdRecord(x, ad_name, asid[1], asid[0])),
+                key=('ad', ad_name, tuple(asid)), retry=True))
         return outcomes
 
     @staticmethod
@@ -1015,12 +1309,14 @@ class CampaignUpload(object):
 
     def upload_all_campaigns(self, api):
         total_campaigns = str(len(self.config))
-        results = []
-        for idx, campaign in enumerate(self.config):
-            logging.info('Uploading campaign ' + str(idx + 1) + ' of ' +
-                         total_campaigns + '.  Campaign Name: ' + campaign)
-            results.append(self.upload_campaign(api, campaign))
-        return results
+        return utl.run_concurrent(
+            lambda x: self.upload_row(api, total_campaigns, *x),
+            enumerate(self.config), api.upload_workers)
+
+    def upload_row(self, api, total_campaigns, idx, campaign):
+        logging.info('Uploading campaign ' + str(idx + 1) + ' of ' +
+                     total_campaigns + '.  Campaign Name: ' + campaign)
+        return copy.copy(self).upload_campaign(api, campaign)
 
     def upload_campaign(self, api, campaign):
         self.check_config(campaign)
@@ -1160,12 +1456,18 @@ class AdSetUpload(object):
 
     def upload_all_adsets(self, api):
         total_adsets = str(len(self.config))
-        results = []
-        for idx, adset in enumerate(self.config):
-            logging.info('Uploading adset ' + str(idx + 1) + ' of ' +
-                         total_adsets + '.  Adset Name: ' + adset)
-            results.extend(self.upload_adset(api, adset))
-        return results
+        with api.batched():
+            results = utl.run_concurrent(
+                lambda x: self.upload_row(api, total_adsets, *x),
+                enumerate(self.config), api.upload_workers)
+        return [x for row in results for x in row]
+
+    def upload_row(self, api, total_adsets, idx, adset):
+        """One adset row on a shallow copy, so the ``as_*`` fields
+        ``set_adset`` writes stay private to the worker pushing it."""
+        logging.info('Uploading adset ' + str(idx + 1) + ' of ' +
+                     total_adsets + '.  Adset Name: ' + adset)
+        return copy.copy(self).upload_adset(api, adset)
 
     def upload_adset(self, api, adset):
         self.set_adset(adset)
@@ -1195,17 +1497,21 @@ class AdSetUpload(object):
             self.as_prom_page, self.as_country, self.as_target,
             self.as_age_min, self.as_age_max, self.as_genders,
             self.as_device, self.as_pubs, self.as_pos) or []
-        return [{
-            'source_name': self.as_name,
-            'object_level': 'Adset',
-            'uploader_type': 'Facebook',
-            'platform_id': o.get('platform_id'),
-            'parent_platform_id': o.get('parent_platform_id'),
-            'status': o.get('status') or 'failed',
-            'error_code': o.get('error_code'),
-            'error_message': o.get('error_message'),
-            'pushed_values': self.raw_rows.get(self.as_key),
-        } for o in outcomes]
+        # Filled in place: a batched create completes its outcome only
+        # when the batch request is sent.
+        for o in outcomes:
+            o.update({
+                'source_name': self.as_name,
+                'object_level': 'Adset',
+                'uploader_type': 'Facebook',
+                'platform_id': o.get('platform_id'),
+                'parent_platform_id': o.get('parent_platform_id'),
+                'status': o.get('status') or 'failed',
+                'error_code': o.get('error_code'),
+                'error_message': o.get('error_message'),
+                'pushed_values': self.raw_rows.get(self.as_key),
+            })
+        return outcomes
 
 
 class AdUpload(object):
@@ -1345,20 +1651,25 @@ class AdUpload(object):
             if not api.adset_dict:
                 campaign_names = [v['campaign_name'][0] for k, v in
                                   self.config.items()]
-                campaign_ids = [x['id'] for x in api.cam_dict if
-                                x['name'] in campaign_names]
+                campaign_ids = api.campaign_to_id(campaign_names)
                 api.set_id_name_dict(AdSet, parent_ids=campaign_ids)
             adset_names = [v['adset_name'][0] for k, v in self.config.items()]
-            adset_ids = [x['id'] for x in api.adset_dict
-                         if x['name'] in adset_names]
+            adset_ids = [asid for name in dict.fromkeys(adset_names)
+                         for asid in api.adset_dict.find(name)]
             api.set_id_name_dict(Ad, parent_ids=adset_ids)
         total_ads = str(len(self.config))
-        results = []
-        for idx, ad in enumerate(self.config):
-            logging.info('Uploading ad ' + str(idx + 1) + ' of ' + total_ads +
-                         '.  Ad Name: ' + ad)
-            results.extend(self.upload_ad(ad, api))
-        return results
+        with api.batched():
+            results = utl.run_concurrent(
+                lambda x: self.upload_row(api, total_ads, *x),
+                enumerate(self.config), api.upload_workers)
+        return [x for row in results for x in row]
+
+    def upload_row(self, api, total_ads, idx, ad):
+        """One ad row on a shallow copy, so the ``ad_*`` fields
+        ``set_ad`` writes stay private to the worker pushing it."""
+        logging.info('Uploading ad ' + str(idx + 1) + ' of ' + total_ads +
+                     '.  Ad Name: ' + ad)
+        return copy.copy(self).upload_ad(ad, api)
 
     def upload_ad(self, ad, api):
         self.set_ad(ad)
@@ -1414,17 +1725,21 @@ class AdUpload(object):
                 self.ad_view_tag, self.ad_status,
                 self.ad_filename)
         outcomes = outcomes or []
-        return [{
-            'source_name': self.ad_name,
-            'object_level': 'Ad',
-            'uploader_type': 'Facebook',
-            'platform_id': o.get('platform_id'),
-            'parent_platform_id': o.get('parent_platform_id'),
-            'status': o.get('status') or 'failed',
-            'error_code': o.get('error_code'),
-            'error_message': o.get('error_message'),
-            'pushed_values': self.raw_rows.get(self.ad_key),
-        } for o in outcomes]
+        # Filled in place: a batched create completes its outcome only
+        # when the batch request is sent.
+        for o in outcomes:
+            o.update({
+                'source_name': self.ad_name,
+                'object_level': 'Ad',
+                'uploader_type': 'Facebook',
+                'platform_id': o.get('platform_id'),
+                'parent_platform_id': o.get('parent_platform_id'),
+                'status': o.get('status') or 'failed',
+                'error_code': o.get('error_code'),
+                'error_message': o.get('error_message'),
+                'pushed_values': self.raw_rows.get(self.ad_key),
+            })
+        return outcomes
 
 
 # Spreadsheet-space column -> ``api_update`` field per level, for
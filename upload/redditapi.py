@@ -6,7 +6,6 @@ import logging
 import os
 import re
 import sys
-import time
 
 import pandas as pd
 import requests
@@ -17,6 +16,7 @@ import uploader.upload.utils as utl
 
 reddit_path = 'reddit'
 config_path = os.path.join(utl.config_file_path, reddit_path)
+snapshot_file = os.path.join(config_path, 'snapshots.db')
 base_url = 'https://ads-api.reddit.com/api/v3'
 CHANNEL = 'Reddit'
 
@@ -130,6 +130,9 @@ def _populate_reddit_result(result, response):
 
 
 class RedditApi(object):
+    rate_limits = {'read': 0.8, 'write': 0.5, 'upload': 0.3}
+    r = utl.ThreadLocalAttr()
+
     def __init__(self, config_file=None):
         self.config_file = config_file
         self.config = None
@@ -152,6 +155,11 @@ class RedditApi(object):
         self.asset_dict = {}
         self._geo_cache = {}
         self._account_ready = False
+        self.snapshots = utl.SnapshotStore(snapshot_file, reddit_path, None)
+        self.snapshot_scopes = {}
+        self.upload_workers = utl.DEFAULT_WORKERS
+        self.limiter = utl.RateLimiter.from_config(self.rate_limits)
+        self.retry = utl.RetryPolicy(label='Reddit')
         self.r = None
         if self.config_file:
             self.input_config(self.config_file)
@@ -188,6 +196,13 @@ class RedditApi(object):
         self.config_list = [
             self.client_id, self.client_secret,
             self.refresh_token, self.refresh_url]
+        self.upload_workers = utl.config_workers(self.config)
+        self.snapshots = utl.SnapshotStore.from_config(
+            snapshot_file, reddit_path, self.ad_account_id or self.username,
+            self.config)
+        self.limiter = utl.RateLimiter.from_config(
+            self.rate_limits, self.config)
+        self.retry = utl.RetryPolicy.from_config(self.config, label='Reddit')
 
     def check_config(self):
         for item in self.config_list:
@@ -336,40 +351,74 @@ class RedditApi(object):
                 'in redditconfig.json to one of: {}'
                 .format(self.ad_account_id, self.username, listing))
 
+    created_dicts = {'campaigns': 'cam_dict', 'ad_groups': 'adgroup_dict',
+                     'ads': 'ad_dict'}
+    # Field of a created object naming the parent its dict is listed by.
+    created_parents = {'ad_groups': 'campaign_id', 'ads': 'ad_group_id'}
+
+    def remember(self, id_dict, response, sent, kind, scope='',
+                 parent_field=None):
+        """Write a created object through to a listed id dict and its
+        snapshot, so later rows find it without relisting. A dict that
+        was never listed, or was listed for another parent, is left
+        alone; listing it picks the object up anyway.
+
+        :param id_dict: the id dict the object's kind is listed into
+        :param response: the create response
+        :param sent: the ``data`` body that was posted
+        :param kind: the dict's snapshot name, e.g. 'cam_dict'
+        :param scope: the parent the dict was listed under
+        :param parent_field: field of ``sent`` holding the object's parent
+        """
+        data = utl.response_body(response).get('data')
+        if not isinstance(id_dict, utl.IdDict) or not isinstance(data, dict):
+            return
+        parent = str(sent.get(parent_field) or '') if parent_field else ''
+        if parent_field and scope not in ('', parent):
+            return
+        if data.get('id'):
+            row = dict(sent)
+            row.update(data)
+            id_dict[data['id']] = row
+            self.snapshots.put(kind, data['id'], row, scope)
+
     def create_entity(self, entity, entity_name=''):
         url = self._entity_url(entity_name)
-        return self._post(url, body={'data': entity.upload_dict})
+        r = self._post(url, body={'data': entity.upload_dict})
+        dict_attr = self.created_dicts.get(entity_name)
+        if dict_attr:
+            self.remember(getattr(self, dict_attr), r, entity.upload_dict,
+                          dict_attr, self.snapshot_scopes.get(dict_attr, ''),
+                          self.created_parents.get(entity_name))
+        return r
+
+    def _send(self, method, url, endpoint_class, **kwargs):
+        """One paced attempt on the authed session; ``self.retry``
+        owns re-sending it."""
+        self.limiter.wait(endpoint_class)
+        return self.client.request(method, url, timeout=REQUEST_TIMEOUT,
+                                   **kwargs)
 
     def _post(self, url, body=None):
         self.get_client()
-        try:
-            self.r = self.client.post(
-                url, json=body or {}, timeout=REQUEST_TIMEOUT)
-        except requests.exceptions.SSLError as e:
-            logging.warning(f'Reddit SSLError: {e}')
-            time.sleep(30)
-            self.r = self._post(url, body=body)
+        self.r = self.retry.run_write(self._send, 'POST', url, 'write',
+                                      json=body or {})
         return self.r
 
     def _get(self, url, params=None):
         self.get_client()
-        return self.client.get(
-            url, params=params or {}, timeout=REQUEST_TIMEOUT)
+        return self.retry.run(self._send, 'GET', url, 'read',
+                              params=params or {})
 
     def _patch(self, url, body=None):
         self.get_client()
-        try:
-            self.r = self.client.patch(
-                url, json=body or {}, timeout=REQUEST_TIMEOUT)
-        except requests.exceptions.SSLError as e:
-            logging.warning(f'Reddit SSLError: {e}')
-            time.sleep(30)
-            self.r = self._patch(url, body=body)
+        self.r = self.retry.run(self._send, 'PATCH', url, 'write',
+                                json=body or {})
         return self.r
 
     @staticmethod
     def get_id(dict_o, match, match_name='name'):
-        return [k for k, v in dict_o.items() if v.get(match_name) == match]
+        return utl.find_ids(dict_o, match, match_name)
 
     def _paginate(self, url, params=None):
         """Yield every ``data`` row across a v3 list endpoint, following
@@ -395,19 +444,33 @@ class RedditApi(object):
     def _list(self, entity_name, params=None):
         """Ad-account resource list keyed by id (campaigns, ad_groups,
         ads, funding_instruments, profiles, pixels)."""
-        return {row['id']: row
-                for row in self._paginate(self._entity_url(entity_name),
-                                          params) if row.get('id')}
+        return utl.IdDict(
+            (row['id'], row)
+            for row in self._paginate(self._entity_url(entity_name), params)
+            if row.get('id'))
+
+    def snapshot_list(self, dict_attr, entity_name, params=None,
+                      filter_id=None):
+        """``_list`` through the snapshot store, scoped to
+        ``filter_id``. The v3 lists can't filter on modified time, so a
+        stale snapshot is relisted in full."""
+        scope = str(filter_id or '')
+        self.snapshot_scopes[dict_attr] = scope
+        return self.snapshots.id_dict(
+            dict_attr, lambda: self._list(entity_name, params=params),
+            scope=scope)
 
     def set_id_dict(self, kind=None, filter_id=None):
         if kind == 'campaign':
-            self.cam_dict = self._list('campaigns')
+            self.cam_dict = self.snapshot_list('cam_dict', 'campaigns')
         elif kind == 'adgroup':
             params = {'campaign_id': filter_id} if filter_id else None
-            self.adgroup_dict = self._list('ad_groups', params=params)
+            self.adgroup_dict = self.snapshot_list(
+                'adgroup_dict', 'ad_groups', params, filter_id)
         elif kind == 'ad':
             params = {'ad_group_id': filter_id} if filter_id else None
-            self.ad_dict = self._list('ads', params=params)
+            self.ad_dict = self.snapshot_list(
+                'ad_dict', 'ads', params, filter_id)
 
     def _id_name_options(self, segment, *name_keys):
         """``[{'id','name'}]`` for an ad-account list, labelled by the
@@ -537,16 +600,24 @@ class RedditApi(object):
         """Create a Post (the ad creative) under a profile; returns the
         raw create response for ``_populate_reddit_result``."""
         url = '{}/profiles/{}/posts'.format(base_url, profile_id)
-        return self._post(url, body={'data': post_dict})
+        r = self._post(url, body={'data': post_dict})
+        self.remember(self.post_dict.get(profile_id), r, post_dict,
+                      'post_dict', profile_id)
+        return r
 
     def list_posts(self, profile_id):
         """Existing posts under a profile, keyed by id, for resolve-by-
-        name (matched on the post headline)."""
+        name (matched on the post headline). Cached per profile."""
         if not profile_id:
             return {}
-        url = '{}/profiles/{}/posts'.format(base_url, profile_id)
-        return {row['id']: row
-                for row in self._paginate(url) if row.get('id')}
+        if profile_id not in self.post_dict:
+            url = '{}/profiles/{}/posts'.format(base_url, profile_id)
+            self.post_dict[profile_id] = self.snapshots.id_dict(
+                'post_dict', lambda: utl.IdDict(
+                    (row['id'], row)
+                    for row in self._paginate(url) if row.get('id')),
+                scope=profile_id)
+        return self.post_dict[profile_id]
 
     def probe_account(self):
         """(ok, message) — verify the ad account is reachable, for the
@@ -663,18 +734,19 @@ class CampaignUpload(utl.BaseUploadConfig):
     def upload_all_campaigns(self, api):
         if not self.config:
             return []
-        results = []
         total = len(self.config)
-        for idx, c_id in enumerate(self.config):
-            cam = Campaign(self.config[c_id], api=api)
-            logging.info(
-                f'Uploading Reddit campaign {idx + 1} of {total}: '
-                f'{cam.name}')
-            result = self.upload_campaign(api, cam)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[c_id], self.snapshot_cols)
-            results.append(result)
-        return results
+        rows = [(idx, c_id, Campaign(self.config[c_id], api=api))
+                for idx, c_id in enumerate(self.config)]
+        return utl.run_concurrent(lambda x: self.upload_row(api, total, *x),
+                                  rows, api.upload_workers)
+
+    def upload_row(self, api, total, idx, c_id, cam):
+        logging.info(
+            f'Uploading Reddit campaign {idx + 1} of {total}: {cam.name}')
+        result = self.upload_campaign(api, cam)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[c_id], self.snapshot_cols)
+        return result
 
     @staticmethod
     def upload_campaign(api, campaign):
@@ -770,18 +842,19 @@ class AdGroupUpload(utl.BaseUploadConfig):
     def upload_all_adgroups(self, api):
         if not self.config:
             return []
-        results = []
         total = len(self.config)
-        for idx, ag_id in enumerate(self.config):
-            ag = AdGroup(self.config[ag_id], api=api)
-            logging.info(
-                f'Uploading Reddit adgroup {idx + 1} of {total}: '
-                f'{ag.name}')
-            result = self.upload_adgroup(api, ag)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[ag_id], self.snapshot_cols)
-            results.append(result)
-        return results
+        rows = [(idx, ag_id, AdGroup(self.config[ag_id], api=api))
+                for idx, ag_id in enumerate(self.config)]
+        return utl.run_concurrent(lambda x: self.upload_row(api, total, *x),
+                                  rows, api.upload_workers)
+
+    def upload_row(self, api, total, idx, ag_id, ag):
+        logging.info(
+            f'Uploading Reddit adgroup {idx + 1} of {total}: {ag.name}')
+        result = self.upload_adgroup(api, ag)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[ag_id], self.snapshot_cols)
+        return result
 
     @staticmethod
     def upload_adgroup(api, adgroup):
@@ -945,19 +1018,23 @@ class AdUpload(utl.BaseUploadConfig):
                      destination_url]
 
     def upload_all_ads(self, api):
+        """Resolve every row in config order — resolving can create the
+        Post an ad points at, which two rows may share — then push the
+        ads themselves concurrently."""
         if not self.config:
             return []
-        results = []
         total = len(self.config)
-        for idx, a_id in enumerate(self.config):
-            ad = Ad(self.config[a_id], api=api)
-            logging.info(
-                f'Uploading Reddit ad {idx + 1} of {total}: {ad.name}')
-            result = self.upload_ad(api, ad)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[a_id], self.snapshot_cols)
-            results.append(result)
-        return results
+        rows = [(idx, a_id, Ad(self.config[a_id], api=api))
+                for idx, a_id in enumerate(self.config)]
+        return utl.run_concurrent(lambda x: self.upload_row(api, total, *x),
+                                  rows, api.upload_workers)
+
+    def upload_row(self, api, total, idx, a_id, ad):
+        logging.info(f'Uploading Reddit ad {idx + 1} of {total}: {ad.name}')
+        result = self.upload_ad(api, ad)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[a_id], self.snapshot_cols)
+        return result
 
     @staticmethod
     def upload_ad(api, ad):
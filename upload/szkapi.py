@@ -13,7 +13,6 @@ import sys
 import time
 import json
 import logging
-import requests
 import pandas as pd
 import upload.utils as utl
 
@@ -34,6 +33,8 @@ class SzkApi(object):
         self.campaign_ids = None
         self.config_list = None
         self.headers = None
+        self.session = None
+        self.pool_size = utl.DEFAULT_WORKERS
         self.adv_dict = None
         self.brd_dict = None
         self.cam_dict = None
@@ -61,6 +62,7 @@ class SzkApi(object):
         self.password = self.config['password']
         self.api_key = self.config['api_key']
         self.campaign_ids = self.config['campaign_ids']
+        self.pool_size = utl.config_workers(self.config, key='pool_size')
         self.config_list = [self.config, self.username, self.password,
                             self.api_key, self.campaign_ids]
 
@@ -71,20 +73,29 @@ class SzkApi(object):
                                 'Aborting.'.format(item))
                 sys.exit(0)
 
+    def get_session(self):
+        if self.session is None:
+            self.session = utl.pooled_session(self.pool_size)
+        return self.session
+
     def set_headers(self):
         self.headers = {'api-key': self.api_key}
         data = {'username': self.username, 'password': self.password}
-        r = requests.post(login_url, data=json.dumps(data),
-                          headers=self.headers)
+        r = self.get_session().post(login_url, data=json.dumps(data),
+                                    headers=self.headers)
         session_id = r.json()['result']['sessionId']
         self.headers['Authorization'] = session_id
+        self.session.headers.update(self.headers)
 
     def make_request(self, url):
         if not self.headers:
             self.set_headers()
-        r = requests.get(url, headers=self.headers)
+        r = self.get_session().get(url)
         return r
 
+    def log_connection_reuse(self):
+        return utl.log_session_reuse(self.session, 'Sizmek')
+
     def set_id_dict(self, szk_object='all'):
         if szk_object in ['campaign', 'brand', 'advertiser', 'all']:
             self.adv_dict = self.get_id_dict('advertisers')
@@ -97,31 +108,28 @@ class SzkApi(object):
         url = "https://adapi.sizmek.com/sas/{}?from=0&max=500".format(szk_obj)
         r = self.make_request(url)
         if parent:
-            id_dict = [{x['id']: {'name': x['name'], 'parent': x[parent]}}
-                       for x in r.json()['result']]
+            id_dict = utl.IdDict(
+                (x['id'], {'name': x['name'], 'parent': x[parent]})
+                for x in r.json()['result'])
         else:
-            id_dict = [{x['id']: {'name': x['name']}}
-                       for x in r.json()['result']]
+            id_dict = utl.IdDict((x['id'], {'name': x['name']})
+                                 for x in r.json()['result'])
         return id_dict
 
     def get_campaign_id_dict(self):
         url = "https://adapi.sizmek.com/sas/campaigns?from=0&max=500"
         r = self.make_request(url)
-        self.cam_dict = [{x['id']: {'name': x['name'],
-                                    'parent': x['advertiserId']}}
-                         for x in r.json()['result']]
+        self.cam_dict = utl.IdDict(
+            (x['id'], {'name': x['name'], 'parent': x['advertiserId']})
+            for x in r.json()['result'])
         return self.cam_dict
 
     @staticmethod
     def get_id(dict_o, match, dict_two=None, match_two=None, parent_id=None):
-        if parent_id:
-            id_list = [k for k, v in dict_o.items() if v['name'] == match
-                       and v['parent'] == parent_id]
-        else:
-            id_list = [k for k, v in dict_o.items() if v['name'] == match]
+        id_list = utl.find_ids(dict_o, match, parent_id=parent_id)
         if dict_two is not None:
-            id_list = [k for k, v in dict_two.items() if v['name'] == match_two
-                       and v['parent'] == id_list[0]]
+            id_list = utl.find_ids(dict_two, match_two,
+                                   parent_id=id_list[0]) if id_list else []
         return id_list
 
 
@@ -19,7 +19,7 @@ import json
 import logging
 import os
 import sys
-import time
+import threading
 
 import pandas as pd
 import requests
@@ -29,6 +29,7 @@ import uploader.upload.utils as utl
 
 tik_path = 'tik'
 config_path = os.path.join(utl.config_file_path, tik_path)
+snapshot_file = os.path.join(config_path, 'snapshots.db')
 base_url = 'https://business-api.tiktok.com/open_api'
 api_version = 'v1.3'
 CHANNEL = 'TikTok'
@@ -186,6 +187,10 @@ def _populate_tik_result(result, response, id_key='campaign_id'):
 
 
 class TikApi(object):
+    rate_limits = {'read': 10, 'write': 5, 'upload': 1}
+    json_headers = {'Content-Type': 'application/json'}
+    r = utl.ThreadLocalAttr()
+
     def __init__(self, config_file=None):
         self.config_file = config_file
         self.config = None
@@ -193,10 +198,17 @@ class TikApi(object):
         self.advertiser_id = None
         self.config_list = None
         self.headers = None
+        self.session = None
+        self.pool_size = utl.DEFAULT_WORKERS
         self.cam_dict = {}
         self.adgroup_dict = {}
         self.ad_dict = {}
         self.id_dict_scope = {}
+        self.id_dict_lock = threading.Lock()
+        self.snapshots = utl.SnapshotStore(snapshot_file, tik_path, None)
+        self.upload_workers = utl.DEFAULT_WORKERS
+        self.limiter = utl.RateLimiter.from_config(self.rate_limits)
+        self.retry = utl.RetryPolicy(label='TikTok')
         self.r = None
         if self.config_file:
             self.input_config(self.config_file)
@@ -221,6 +233,14 @@ class TikApi(object):
         self.access_token = self.config.get('access_token', '')
         self.advertiser_id = str(self.config.get('advertiser_id', '') or '')
         self.config_list = [self.access_token, self.advertiser_id]
+        self.upload_workers = utl.config_workers(self.config)
+        self.snapshots = utl.SnapshotStore.from_config(
+            snapshot_file, tik_path, self.advertiser_id, self.config)
+        self.pool_size = utl.config_workers(
+            self.config, key='pool_size', default=self.upload_workers)
+        self.limiter = utl.RateLimiter.from_config(
+            self.rate_limits, self.config)
+        self.retry = utl.RetryPolicy.from_config(self.config, label='TikTok')
 
     def check_config(self):
         """Both keys are required for writes — unlike the processor's
@@ -235,35 +255,55 @@ class TikApi(object):
                         'Content-Type': 'application/json'}
         return self.headers
 
-    def _post(self, url, body=None):
-        self.set_headers()
-        try:
-            self.r = requests.post(url, headers=self.headers,
-                                   json=body or {}, timeout=REQUEST_TIMEOUT)
-        except requests.exceptions.SSLError as e:
-            logging.warning(f'TikTok SSLError: {e}')
-            time.sleep(30)
-            self.r = self._post(url, body=body)
+    def get_session(self):
+        """The keep-alive session every call goes through, built once
+        with a pool of ``pool_size`` connections (``pool_size`` in the
+        config, else ``upload_workers``). Only the token rides on the
+        session; the JSON Content-Type is added per call so multipart
+        uploads can set their own."""
+        if self.session is None:
+            self.set_headers()
+            self.session = utl.pooled_session(
+                self.pool_size, {'Access-Token': self.access_token})
+        return self.session
+
+    def log_connection_reuse(self):
+        return utl.log_session_reuse(self.session, 'TikTok')
+
+    def _send(self, method, url, endpoint_class, **kwargs):
+        """One paced attempt on the pooled session; ``self.retry``
+        owns re-sending it."""
+        session = self.get_session()
+        self.limiter.wait(endpoint_class)
+        return session.request(method, url, **kwargs)
+
+    def _post(self, url, body=None, create=True):
+        """POST under ``self.retry``; a ``create`` is only resent when
+        TikTok can't have acted on it, so it is never made twice."""
+        run = self.retry.run_write if create else self.retry.run
+        self.r = run(self._send, 'POST', url, 'write',
+                     headers=self.json_headers, json=body or {},
+                     timeout=REQUEST_TIMEOUT)
         return self.r
 
     def _get(self, url, params=None):
-        self.set_headers()
-        return requests.get(url, headers=self.headers,
-                            params=params or {}, timeout=REQUEST_TIMEOUT)
+        return self.retry.run(self._send, 'GET', url, 'read',
+                              headers=self.json_headers,
+                              params=params or {}, timeout=REQUEST_TIMEOUT)
 
     def _post_file(self, url, data=None, files=None):
         """Multipart POST for the asset-library uploads. The JSON
         Content-Type is deliberately dropped — requests has to set the
         multipart boundary itself, and sending application/json here
         makes TikTok reject the body."""
-        self.set_headers()
-        headers = {'Access-Token': self.access_token}
-        return requests.post(url, headers=headers, data=data or {},
-                             files=files or {}, timeout=UPLOAD_TIMEOUT)
+        self.limiter.wait('upload')
+        return self.get_session().post(url, data=data or {},
+                                       files=files or {},
+                                       timeout=UPLOAD_TIMEOUT)
 
     @staticmethod
     def get_id(dict_o, match, match_name='name'):
-        return [k for k, v in dict_o.items() if v.get(match_name) == match]
+        return utl.find_ids(dict_o, match, match_name)
 
     def _list_pages(self, endpoint, params=None):
         """Yield every ``data.list`` row across a v1.3 list endpoint.
@@ -315,17 +355,29 @@ class TikApi(object):
         with the whole account rather than an error, silently widening
         the name-match that decides ``skipped_exists``.
 
+        Read through the snapshot store; TikTok lists can't filter on
+        modified time, so a stale snapshot is relisted in full.
+
         :param kind: one of ``campaign`` / ``adgroup`` / ``ad``
         :param filter_id: parent platform id to scope to
         """
-        spec = self.list_specs.get(kind)
-        if not spec:
+        if kind not in self.list_specs:
             return
-        endpoint, id_field, name_field, parent_field, filter_key = spec
+        found = self.snapshots.id_dict(
+            self.id_dict_attrs[kind],
+            lambda: self.list_id_dict(kind, filter_id),
+            scope=str(filter_id or ''))
+        setattr(self, self.id_dict_attrs[kind], found)
+        self.id_dict_scope[kind] = str(filter_id or '')
+
+    def list_id_dict(self, kind, filter_id=None):
+        """One level listed live into an id dict (see ``set_id_dict``)."""
+        endpoint, id_field, name_field, parent_field, filter_key = (
+            self.list_specs[kind])
         params = {}
         if filter_id and filter_key:
             params['filtering'] = json.dumps({filter_key: [str(filter_id)]})
-        found = {}
+        found = utl.IdDict()
         for row in self._list_pages(endpoint, params=params):
             oid = row.get(id_field)
             if not oid:
@@ -336,8 +388,7 @@ class TikApi(object):
             found[str(oid)] = {'id': str(oid),
                                'name': row.get(name_field, ''),
                                'parent_id': parent}
-        setattr(self, self.id_dict_attrs[kind], found)
-        self.id_dict_scope[kind] = str(filter_id or '')
+        return found
 
     def ensure_id_dict(self, kind, filter_id=None):
         """The ``kind`` dict, re-listed when it is missing or was built
@@ -350,21 +401,62 @@ class TikApi(object):
         ``skipped_exists`` against another ad group's ad. A parent with
         no children yet is a legitimate empty result.
 
+        Held under a lock so concurrent rows scoped to different parents
+        never read a dict another row is part-way through re-listing;
+        callers use the returned dict, not the attribute.
+
         :param kind: one of ``campaign`` / ``adgroup`` / ``ad``
         :param filter_id: parent platform id to scope to
         :returns: the id dict for ``kind``
         """
         scope = str(filter_id or '')
-        if self.id_dict_scope.get(kind, _UNSCOPED) != scope:
-            self.set_id_dict(kind, filter_id=filter_id)
-        return getattr(self, self.id_dict_attrs[kind])
+        with self.id_dict_lock:
+            if self.id_dict_scope.get(kind, _UNSCOPED) != scope:
+                self.set_id_dict(kind, filter_id=filter_id)
+            return getattr(self, self.id_dict_attrs[kind])
 
     def create_entity(self, entity, entity_name='campaign'):
         """POST the entity's ``upload_dict`` to the level's create
         endpoint; the advertiser id rides every write."""
         body = dict(entity.upload_dict)
         body['advertiser_id'] = self.advertiser_id
-        return self._post(_api_url(f'/{entity_name}/create/'), body=body)
+        r = self._post(_api_url(f'/{entity_name}/create/'), body=body)
+        self.remember(entity_name, body, r)
+        return r
+
+    def remember(self, kind, body, response):
+        """Write a created object through to the ``kind`` id dict, so
+        later rows under the same parent find it without relisting.
+
+        Only a dict already scoped to the object's parent (or listed
+        unscoped) takes the row; any other scope re-lists on its next
+        ``ensure_id_dict`` and picks the object up there.
+
+        :param kind: one of ``campaign`` / ``adgroup`` / ``ad``
+        :param body: the create body that was posted
+        :param response: the create response
+        """
+        spec = self.list_specs.get(kind)
+        resp = utl.response_body(response)
+        if not spec or _extract_error(resp):
+            return
+        _, id_field, name_field, parent_field, _ = spec
+        oid = _platform_id(resp.get('data') or {}, id_field)
+        if not oid:
+            return
+        sent = dict(body)
+        # /ad/create/ carries the ad name inside its creatives list.
+        for creative in (body.get('creatives') or [])[:1]:
+            sent.update(creative)
+        parent = str(sent.get(parent_field) or '') if parent_field else ''
+        row = {'id': oid, 'name': sent.get(name_field, ''),
+               'parent_id': parent}
+        with self.id_dict_lock:
+            scope = self.id_dict_scope.get(kind, _UNSCOPED)
+            if scope not in ('', parent):
+                return
+            getattr(self, self.id_dict_attrs[kind])[oid] = row
+        self.snapshots.put(self.id_dict_attrs[kind], oid, row, scope)
 
     def probe_account(self):
         """(ok, message) — verify the token reaches the configured
@@ -457,7 +549,8 @@ class TikApi(object):
                         id_field: [str(pid)],
                         'operation_status': status}
                 err = _extract_error(utl.response_body(
-                    self._post(_api_url(endpoint), body=body)))
+                    self._post(_api_url(endpoint), body=body,
+                               create=False)))
                 if err:
                     utl.fail_result(
                         result,
@@ -486,18 +579,19 @@ class CampaignUpload(utl.BaseUploadConfig):
     def upload_all_campaigns(self, api):
         if not self.config:
             return []
-        results = []
         total = len(self.config)
-        for idx, c_id in enumerate(self.config):
-            cam = Campaign(self.config[c_id], api=api)
-            logging.info(
-                f'Uploading TikTok campaign {idx + 1} of {total}: '
-                f'{cam.name}')
-            result = self.upload_campaign(api, cam)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[c_id], self.snapshot_cols)
-            results.append(result)
-        return results
+        rows = [(idx, c_id, Campaign(self.config[c_id], api=api))
+                for idx, c_id in enumerate(self.config)]
+        return utl.run_concurrent(lambda x: self.upload_row(api, total, *x),
+                                  rows, api.upload_workers)
+
+    def upload_row(self, api, total, idx, c_id, cam):
+        logging.info(
+            f'Uploading TikTok campaign {idx + 1} of {total}: {cam.name}')
+        result = self.upload_campaign(api, cam)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[c_id], self.snapshot_cols)
+        return result
 
     @staticmethod
     def upload_campaign(api, campaign):
@@ -611,17 +705,19 @@ class AdGroupUpload(utl.BaseUploadConfig):
     def upload_all_adgroups(self, api):
         if not self.config:
             return []
-        results = []
         total = len(self.config)
-        for idx, ag_id in enumerate(self.config):
-            ag = AdGroup(self.config[ag_id], api=api)
-            logging.info(
-                f'Uploading TikTok adgroup {idx + 1} of {total}: {ag.name}')
-            result = self.upload_adgroup(api, ag)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[ag_id], self.snapshot_cols)
-            results.append(result)
-        return results
+        rows = [(idx, ag_id, AdGroup(self.config[ag_id], api=api))
+                for idx, ag_id in enumerate(self.config)]
+        return utl.run_concurrent(lambda x: self.upload_row(api, total, *x),
+                                  rows, api.upload_workers)
+
+    def upload_row(self, api, total, idx, ag_id, ag):
+        logging.info(
+            f'Uploading TikTok adgroup {idx + 1} of {total}: {ag.name}')
+        result = self.upload_adgroup(api, ag)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[ag_id], self.snapshot_cols)
+        return result
 
     @staticmethod
     def upload_adgroup(api, adgroup):
@@ -876,18 +972,19 @@ class AdUpload(utl.BaseUploadConfig):
             return []
         if creative_store is not None:
             creative_store.upload_all(api, self.creative_filenames())
-        results = []
         total = len(self.config)
-        for idx, a_id in enumerate(self.config):
-            ad = Ad(self.config[a_id], api=api,
-                    creative_store=creative_store)
-            logging.info(
-                f'Uploading TikTok ad {idx + 1} of {total}: {ad.name}')
-            result = self.upload_ad(api, ad)
-            result['pushed_values'] = utl.snapshot_values(
-                self.config[a_id], self.snapshot_cols)
-            results.append(result)
-        return results
+        rows = [(idx, a_id, Ad(self.config[a_id], api=api,
+                               creative_store=creative_store))
+                for idx, a_id in enumerate(self.config)]
+        return utl.run_concurrent(lambda x: self.upload_row(api, total, *x),
+                                  rows, api.upload_workers)
+
+    def upload_row(self, api, total, idx, a_id, ad):
+        logging.info(f'Uploading TikTok ad {idx + 1} of {total}: {ad.name}')
+        result = self.upload_ad(api, ad)
+        result['pushed_values'] = utl.snapshot_values(
+            self.config[a_id], self.snapshot_cols)
+        return result
 
     @staticmethod
     def upload_ad(api, ad):
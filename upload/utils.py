@@ -1,16 +1,32 @@
 import os
 import re
+import json
+import base64
+import codecs
+import sqlite3
 import time
+import random
 import logging
 import zipfile
+import threading
+import contextlib
+import email.utils
 import xml.etree.ElementTree as ET
 import pandas as pd
+import urllib3
+import requests
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from requests_oauthlib import OAuth2Session
 
 config_file_path = 'config/'
 err_file_path = 'ERROR_REPORTS/'
 static_types = ['jpg', 'png', 'jpeg']
 video_types = ['mp4', 'mpg', 'm4v', 'mkv', 'webm', 'mov', 'avi', 'wmv', 'flv']
+# Rows per level pushed at once unless a channel config says otherwise.
+# One keeps every loop sequential, exactly as before the executor.
+DEFAULT_WORKERS = 1
 
 
 def dir_check(directory):
@@ -97,6 +113,63 @@ def response_body(response):
     return body if isinstance(body, dict) else {}
 
 
+_json_token = re.compile(r'[][{}"\\]')
+_json_string_token = re.compile(r'["\\]')
+
+
+def iter_json_array(chunks):
+    """Yield each object (or array) element of a top-level JSON array
+    as soon as its closing bracket arrives, so a large streamed body is
+    parsed batch by batch without ever holding all of it. Only the
+    element being read is buffered.
+
+    :param chunks: iterable of bytes (UTF-8) or str pieces of the body,
+        e.g. ``response.iter_content(chunk_size)``
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    depth = 0
+    start = None
+    in_string = False
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        buf += chunk
+        while True:
+            token = _json_string_token if in_string else _json_token
+            m = token.search(buf, pos)
+            if not m:
+                pos = len(buf)
+                break
+            char = m.group()
+            pos = m.end()
+            if in_string:
+                if char == '"':
+                    in_string = False
+                elif pos < len(buf):
+                    pos += 1
+                else:
+                    pos = m.start()
+                    break
+            elif char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+                if depth == 2:
+                    start = m.start()
+            else:
+                depth -= 1
+                if depth == 1 and start is not None:
+                    yield json.loads(buf[start:pos])
+                    buf = buf[pos:]
+                    pos = 0
+                    start = None
+        if start is None:
+            buf = buf[pos:]
+            pos = 0
+
+
 def new_result(object_level, source_name, uploader_type, parent_id=None):
     """The per-object result row every channel's upload loop returns.
 
@@ -136,10 +209,837 @@ def fail_result(result, message, code=None):
     return result
 
 
+def config_workers(config, key='upload_workers', default=DEFAULT_WORKERS):
+    """Worker count for a channel's ``upload_all_*`` loops, read from
+    the channel config (``"upload_workers": 8``).
+
+    :param config: the channel's loaded config dict (may be None)
+    :param key: config key holding the count
+    :param default: count used when the key is absent or malformed
+    :returns: an int >= 1
+    """
+    return config_int(config, key, default)
+
+
+def config_int(config, key, default, minimum=1):
+    """Integer setting from a channel config, e.g. a batch or cache
+    size, raised to ``minimum`` when set lower.
+
+    :param config: the channel's loaded config dict (may be None)
+    :param key: config key holding the value
+    :param default: value used when the key is absent or malformed
+    :param minimum: smallest value allowed; 0 lets a size be switched off
+    :returns: an int >= minimum, or ``default``
+    """
+    value = (config or {}).get(key) if isinstance(config, dict) else None
+    if value in (None, ''):
+        return default
+    try:
+        return max(minimum, int(value))
+    except (TypeError, ValueError):
+        logging.warning(f'{key} is not a number: {value!r}.  '
+                        f'Using {default}.')
+        return default
+
+
+def run_concurrent(fnc, items, workers=DEFAULT_WORKERS):
+    """Call ``fnc`` on every item and return the results in ``items``
+    order, running up to ``workers`` calls at once.
+
+    The first item always runs alone: every channel resolves its id
+    dicts lazily on first use, so letting one row prime them keeps the
+    rest of the pool from relisting the account in parallel. With one
+    worker (the default) this is a plain sequential loop.
+
+    :param fnc: callable taking one item and returning its result
+    :param items: iterable of work items, e.g. ``enumerate(config)``
+    :param workers: max concurrent calls
+    :returns: list of results, one per item, in order
+    """
+    items = list(items)
+    if not items:
+        return []
+    workers = max(1, int(workers or 1))
+    results = [fnc(items[0])]
+    rest = items[1:]
+    if workers == 1 or not rest:
+        results.extend(fnc(x) for x in rest)
+        return results
+    with ThreadPoolExecutor(max_workers=min(workers, len(rest))) as pool:
+        results.extend(pool.map(fnc, rest))
+    return results
+
+
+def pooled_session(pool_size=DEFAULT_WORKERS, headers=None):
+    """Keep-alive ``requests.Session`` whose connection pool holds
+    ``pool_size`` sockets per host, so ``pool_size`` upload workers each
+    reuse a warm connection instead of paying a TCP+TLS handshake.
+
+    :param pool_size: connections kept per host
+    :param headers: headers sent on every request
+    :returns: the mounted session
+    """
+    pool_size = max(1, int(pool_size or 1))
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def session_reuse_stats(session):
+    """Requests sent and connections opened over a ``pooled_session``.
+
+    :param session: the session to inspect (may be None)
+    :returns: dict of ``requests``, ``connections`` and ``reused``
+    """
+    stats = {'requests': 0, 'connections': 0, 'reused': 0}
+    if session is None:
+        return stats
+    for adapter in session.adapters.values():
+        pools = getattr(getattr(adapter, 'poolmanager', None), 'pools', None)
+        if pools is None:
+            continue
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+    stats['reused'] = max(0, stats['requests'] - stats['connections'])
+    return stats
+
+
+def log_session_reuse(session, label):
+    """Log ``session_reuse_stats`` for a channel and return them."""
+    stats = session_reuse_stats(session)
+    logging.info(f'{label} HTTP: {stats["requests"]} requests over '
+                 f'{stats["connections"]} connections '
+                 f'({stats["reused"]} reused).')
+    return stats
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket: ``rate`` tokens refill per second up to
+    ``capacity``, and ``acquire`` blocks until one is available."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """Take ``tokens``, sleeping until the bucket holds them.
+
+        :param tokens: tokens the request costs
+        :returns: seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class RateLimiter(object):
+    """One ``TokenBucket`` per endpoint class (read / write / upload)
+    for a single channel client.
+
+    Channels declare their default quotas as a ``rate_limits`` class
+    dict of requests per second; a channel config overrides any class
+    with a ``rate_limits`` key, either a number or
+    ``{"rate": 5, "burst": 10}``. A rate of 0 leaves that class
+    unpaced.
+    """
+    endpoint_classes = ('read', 'write', 'upload')
+    config_key = 'rate_limits'
+
+    def __init__(self, quotas=None):
+        self.buckets = {}
+        for endpoint_class, quota in (quotas or {}).items():
+            rate, burst = self.parse_quota(quota)
+            if rate:
+                self.buckets[endpoint_class] = TokenBucket(rate, burst)
+
+    @staticmethod
+    def parse_quota(quota):
+        if isinstance(quota, dict):
+            return (float(quota.get('rate') or 0),
+                    float(quota.get('burst') or 0) or None)
+        return float(quota or 0), None
+
+    @classmethod
+    def from_config(cls, defaults, config=None):
+        """Limiter built from a channel's default quotas with any
+        ``rate_limits`` overrides from its config applied on top.
+
+        :param defaults: ``{endpoint_class: requests per second}``
+        :param config: the channel's loaded config dict (may be None)
+        :returns: a ``RateLimiter``
+        """
+        quotas = dict(defaults or {})
+        if isinstance(config, dict):
+            overrides = config.get(cls.config_key)
+        else:
+            overrides = None
+        for endpoint_class, quota in (overrides or {}).items():
+            if endpoint_class not in cls.endpoint_classes:
+                logging.warning(f'Unknown rate limit class {endpoint_class}.'
+                                f'  Use one of {cls.endpoint_classes}.')
+                continue
+            quotas[endpoint_class] = quota
+        return cls(quotas)
+
+    def wait(self, endpoint_class='read'):
+        """Block until a request of ``endpoint_class`` may be sent.
+
+        :param endpoint_class: read, write or upload
+        :returns: seconds spent waiting
+        """
+        bucket = self.buckets.get(endpoint_class)
+        if bucket is None:
+            return 0.0
+        return bucket.acquire()
+
+
+class ThreadLocalAttr(object):
+    """Instance attribute that holds a separate value per thread.
+
+    Channel clients stash the last response on ``self.r``; declaring
+    ``r = utl.ThreadLocalAttr()`` on the class keeps that slot private
+    to each upload worker so rows never read each other's response.
+    Unset values read as ``None``.
+    """
+
+    def __init__(self):
+        self.key = None
+
+    def __set_name__(self, owner, name):
+        self.key = '_local_{}'.format(name)
+
+    def _local(self, instance):
+        return instance.__dict__.setdefault(self.key, threading.local())
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(self._local(instance), 'value', None)
+
+    def __set__(self, instance, value):
+        self._local(instance).value = value
+
+
+def retry_after(outcome):
+    """Seconds a throttled response (or the exception carrying it) asks
+    the caller to wait via ``Retry-After``; None when it says nothing.
+
+    :param outcome: a response, or an exception with ``response`` /
+        ``http_headers()`` (the FB SDK's ``FacebookRequestError``)
+    :returns: float seconds or None
+    """
+    headers = getattr(outcome, 'headers', None)
+    if headers is None and callable(getattr(outcome, 'http_headers', None)):
+        headers = outcome.http_headers()
+    if headers is None:
+        headers = getattr(getattr(outcome, 'response', None), 'headers', None)
+    try:
+        value = (headers or {}).get('Retry-After')
+    except AttributeError:
+        return None
+    if value in (None, ''):
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def classify_http_error(outcome):
+    """Default retry classifier for ``requests``-based channels.
+
+    :param outcome: the exception raised, or the response returned
+    :returns: ``ssl``, ``connection``, ``throttled`` or ``server`` for a
+        transient failure, else None (do not retry)
+    """
+    if isinstance(outcome, requests.exceptions.SSLError):
+        return 'ssl'
+    if isinstance(outcome, (requests.exceptions.ConnectionError,
+                            requests.exceptions.Timeout,
+                            urllib3.exceptions.HTTPError)):
+        return 'connection'
+    if isinstance(outcome, BaseException):
+        return None
+    status = getattr(outcome, 'status_code', None)
+    if status == 429:
+        return 'throttled'
+    if status in (500, 502, 503, 504):
+        return 'server'
+    return None
+
+
+def classify_write_error(outcome):
+    """Retry classifier for non-idempotent writes (creates). Only
+    failures the server cannot have acted on are retried: a connection
+    that was never made, and 429. A read timeout or 5xx may arrive
+    after the create committed, so resending it could duplicate it.
+
+    :param outcome: the exception raised, or the response returned
+    :returns: ``ssl``, ``connection`` or ``throttled``, else None
+    """
+    if isinstance(outcome, requests.exceptions.SSLError):
+        return 'ssl'
+    if isinstance(outcome, requests.exceptions.ConnectionError):
+        return 'connection'
+    if isinstance(outcome, BaseException):
+        return None
+    if getattr(outcome, 'status_code', None) == 429:
+        return 'throttled'
+    return None
+
+
+class RetryPolicy(object):
+    """Loop-based retry with exponential backoff, full jitter and
+    ``Retry-After``, bounded by a retry budget per error class.
+
+    ``classify`` maps each attempt's outcome (the raised exception or
+    the returned value) to an error class, or None when the outcome is
+    final; ``classify_write`` does the same for ``run_write``, which
+    sends creates. Each class may be retried ``budgets[class]`` times
+    per call;
+    a class missing from ``budgets`` is never retried. Once a budget is
+    spent the last exception is re-raised, or the last value returned.
+    A channel config may override budgets under ``retry_budgets``.
+    """
+    default_budgets = {'ssl': 5, 'connection': 5, 'throttled': 8,
+                       'server': 3}
+    config_key = 'retry_budgets'
+    max_retry_after = 600
+
+    def __init__(self, budgets=None, classify=classify_http_error,
+                 base_delay=1.0, max_delay=120.0, label='',
+                 classify_write=classify_write_error):
+        self.budgets = dict(self.default_budgets if budgets is None
+                            else budgets)
+        self.classify = classify
+        self.classify_write = classify_write
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.label = label
+
+    @classmethod
+    def from_config(cls, config=None, budgets=None, **kwargs):
+        """Policy whose budgets are ``budgets`` (or the defaults) with
+        the config's ``retry_budgets`` applied on top."""
+        budgets = dict(cls.default_budgets if budgets is None else budgets)
+        if isinstance(config, dict):
+            for error_class, budget in (config.get(cls.config_key)
+                                        or {}).items():
+                budgets[error_class] = int(budget)
+        return cls(budgets=budgets, **kwargs)
+
+    def delay(self, attempt, wait=None):
+        """Seconds before retry ``attempt`` (0-based): the server's
+        ``Retry-After`` when given, else full-jitter exponential."""
+        if wait is not None:
+            return min(wait, self.max_retry_after) + random.uniform(
+                0, self.base_delay)
+        cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    def run(self, fnc, *args, **kwargs):
+        """Call ``fnc(*args, **kwargs)`` until it succeeds, fails in an
+        unclassified way, or its error class runs out of budget.
+
+        :returns: the final return value of ``fnc``
+        """
+        return self._run(self.classify, fnc, *args, **kwargs)
+
+    def run_write(self, fnc, *args, **kwargs):
+        """``run`` for a create that must not be sent twice: retried
+        only as ``classify_write`` allows.
+
+        :returns: the final return value of ``fnc``
+        """
+        return self._run(self.classify_write, fnc, *args, **kwargs)
+
+    def _run(self, classify, fnc, *args, **kwargs):
+        used = {}
+        attempt = 0
+        while True:
+            error = None
+            result = None
+            try:
+                result = fnc(*args, **kwargs)
+            except Exception as e:
+                error = e
+            outcome = result if error is None else error
+            error_class = classify(outcome)
+            if error_class is None:
+                break
+            used[error_class] = used.get(error_class, 0) + 1
+            if used[error_class] > self.budgets.get(error_class, 0):
+                logging.warning(f'{self.label} {error_class} retry budget '
+                                f'spent: {self._describe(outcome)}')
+                break
+            wait = self.delay(attempt, retry_after(outcome))
+            attempt += 1
+            logging.warning(f'{self.label} {error_class} error, retry '
+                            f'{used[error_class]} in {wait:.1f}s: '
+                            f'{self._describe(outcome)}')
+            time.sleep(wait)
+        if error is not None:
+            raise error
+        return result
+
+    @staticmethod
+    def _describe(outcome):
+        if isinstance(outcome, BaseException):
+            return str(outcome)
+        status = getattr(outcome, 'status_code', None)
+        return f'HTTP {status}' if status is not None else repr(outcome)
+
+
 class UploaderAuthError(Exception):
     """Channel credential/refresh failure — fatal, message secret-free."""
 
 
+class OAuthTokenManager(object):
+    """One long-lived ``OAuth2Session`` per channel client, refreshed
+    only when its access token is within ``refresh_margin`` seconds of
+    ``expires_at`` rather than on every request.
+
+    With a ``token_file`` the access token and its expiry are written
+    after each refresh and read back on start-up, so back-to-back runs
+    reuse a still-valid token. The file is keyed on ``client_id`` and a
+    token saved for another client is ignored.
+    """
+    refresh_margin = 300
+
+    def __init__(self, client_id, client_secret, refresh_token,
+                 refresh_url, access_token=None, expires_at=None,
+                 token_file=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_token = refresh_token
+        self.refresh_url = refresh_url
+        self.token_file = token_file
+        self.session = None
+        self.lock = threading.Lock()
+        self.retry = RetryPolicy(label='OAuth refresh')
+        self.token = {'access_token': access_token or '',
+                      'refresh_token': refresh_token,
+                      'token_type': 'Bearer',
+                      'expires_at': float(expires_at or 0)}
+        self.load_token()
+
+    def load_token(self):
+        if not self.token_file or not os.path.isfile(self.token_file):
+            return
+        try:
+            with open(self.token_file, 'r') as f:
+                saved = json.load(f)
+        except (IOError, ValueError) as e:
+            logging.warning(f'Could not read {self.token_file}: {e}')
+            return
+        if str(saved.get('client_id')) != str(self.client_id):
+            return
+        self.token['access_token'] = saved.get('access_token', '')
+        self.token['expires_at'] = float(saved.get('expires_at') or 0)
+
+    def save_token(self):
+        if not self.token_file:
+            return
+        saved = {'client_id': self.client_id,
+                 'access_token': self.token.get('access_token', ''),
+                 'expires_at': self.token.get('expires_at', 0)}
+        tmp_file = '{}.tmp'.format(self.token_file)
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(saved, f)
+            os.replace(tmp_file, self.token_file)
+        except IOError as e:
+            logging.warning(f'Could not write {self.token_file}: {e}')
+
+    def expired(self):
+        expires_at = float(self.token.get('expires_at') or 0)
+        return (not self.token.get('access_token')
+                or time.time() + self.refresh_margin >= expires_at)
+
+    def refresh(self):
+        """Exchange the refresh token for a new access token on the
+        existing session, retrying connection errors.
+
+        :returns: the refreshed token dict
+        """
+        extra = {'client_id': self.client_id,
+                 'client_secret': self.client_secret}
+        try:
+            token = self.retry.run(
+                self.session.refresh_token, self.refresh_url,
+                refresh_token=self.refresh_token, **extra)
+        except requests.exceptions.RequestException as e:
+            raise UploaderAuthError(
+                'OAuth token refresh failed: {}'.format(type(e).__name__))
+        self.token = dict(token)
+        self.save_token()
+        return self.token
+
+    def get_session(self):
+        """The shared session, refreshed first if its token is near
+        expiry. Safe to call from every request and every worker.
+
+        :returns: an authorised ``OAuth2Session``
+        """
+        with self.lock:
+            if self.session is None:
+                self.session = OAuth2Session(self.client_id, token=self.token)
+            if self.expired():
+                self.refresh()
+        return self.session
+
+
+def _index_key(value):
+    """Hashable form of a row field: lists become tuples and anything
+    else unhashable falls back to its repr."""
+    if isinstance(value, list):
+        return tuple(_index_key(x) for x in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def fingerprint(value):
+    """Canonical hashable form of a nested operand: dicts become
+    frozensets of their items and lists tuples, so two operands hash
+    alike exactly when they compare equal."""
+    if isinstance(value, dict):
+        return frozenset((k, fingerprint(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(fingerprint(x) for x in value)
+    return _index_key(value)
+
+
+class IdDict(dict):
+    """``{platform id: row}`` id dict that also keeps hash indexes over
+    row fields, so finding an id by name — optionally under a parent —
+    or by an alternate key such as ``url`` is one probe instead of a
+    scan of the whole account.
+
+    An index per ``(match_name, parent_name)`` pair is built on its
+    first lookup and then kept current by every write through the dict
+    API, so pages can be added as they load. ``parent_name`` may be a
+    tuple of fields for a composite parent, matched by a tuple
+    ``parent_id``. Rows may be dicts or objects with attributes (e.g.
+    namedtuples).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(IdDict, self).__init__(*args, **kwargs)
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    @staticmethod
+    def field(row, name):
+        if isinstance(row, dict):
+            return row.get(name)
+        return getattr(row, name, None)
+
+    @staticmethod
+    def _parent_key(parent):
+        if isinstance(parent, tuple):
+            return tuple(str(x) for x in parent)
+        return str(parent)
+
+    def _row_key(self, row, index_name):
+        match_name, parent_name = index_name
+        value = _index_key(self.field(row, match_name))
+        if parent_name is None:
+            return value
+        if isinstance(parent_name, tuple):
+            parent = tuple(self.field(row, x) for x in parent_name)
+        else:
+            parent = self.field(row, parent_name)
+        return value, self._parent_key(parent)
+
+    def _add(self, k, row):
+        for index_name, index in self._indexes.items():
+            index.setdefault(self._row_key(row, index_name), []).append(k)
+
+    def _discard(self, k, row):
+        for index_name, index in self._indexes.items():
+            ids = index.get(self._row_key(row, index_name))
+            if ids and k in ids:
+                ids.remove(k)
+
+    def __setitem__(self, k, row):
+        with self._lock:
+            if k in self:
+                self._discard(k, dict.__getitem__(self, k))
+            super(IdDict, self).__setitem__(k, row)
+            self._add(k, row)
+
+    def __delitem__(self, k):
+        with self._lock:
+            self._discard(k, dict.__getitem__(self, k))
+            super(IdDict, self).__delitem__(k)
+
+    def update(self, *args, **kwargs):
+        for k, row in dict(*args, **kwargs).items():
+            self[k] = row
+
+    def setdefault(self, k, row=None):
+        with self._lock:
+            if k not in self:
+                self[k] = row
+            return self[k]
+
+    def pop(self, k, *default):
+        with self._lock:
+            if k in self:
+                row = self[k]
+                del self[k]
+                return row
+            return super(IdDict, self).pop(k, *default)
+
+    def popitem(self):
+        with self._lock:
+            k, row = super(IdDict, self).popitem()
+            self._discard(k, row)
+            return k, row
+
+    def clear(self):
+        with self._lock:
+            super(IdDict, self).clear()
+            self._indexes = {}
+
+    def index(self, match_name='name', parent_name=None):
+        """The ``{key: [ids]}`` index for one field (plus parent),
+        built from the current rows on first use."""
+        index_name = (match_name, parent_name)
+        with self._lock:
+            index = self._indexes.get(index_name)
+            if index is None:
+                index = {}
+                for k, row in self.items():
+                    index.setdefault(
+                        self._row_key(row, index_name), []).append(k)
+                self._indexes[index_name] = index
+            return index
+
+    def find(self, match, match_name='name', parent_id=None,
+             parent_name='parent'):
+        """Ids whose ``match_name`` field equals ``match``, limited to
+        rows whose ``parent_name`` field equals ``parent_id`` when one
+        is given. Ids come back in insertion order.
+
+        :returns: list of ids
+        """
+        if parent_id:
+            index = self.index(match_name, parent_name)
+            ids = index.get((_index_key(match), self._parent_key(parent_id)))
+        else:
+            ids = self.index(match_name).get(_index_key(match))
+        return list(ids or [])
+
+
+def find_ids(dict_o, match, match_name='name', parent_id=None,
+             parent_name='parent'):
+    """``IdDict.find`` for any id dict; a plain dict is indexed on the
+    fly, which costs the same single pass the old scans did.
+
+    :param dict_o: ``{id: row}`` dict, ideally an ``IdDict``
+    :param match: value to look up
+    :param match_name: row field to match on
+    :param parent_id: optional parent the row must belong to
+    :param parent_name: row field holding the parent
+    :returns: list of matching ids
+    """
+    if not isinstance(dict_o, IdDict):
+        dict_o = IdDict(dict_o or {})
+    return dict_o.find(match, match_name, parent_id, parent_name)
+
+
+class SnapshotStore(object):
+    """SQLite snapshot of a channel's listed id dicts, one file per
+    channel holding a row set per ``(account, kind, scope)``, so a warm
+    run reads its account from disk instead of relisting it.
+
+    A snapshot younger than ``ttl`` seconds is used as-is. Past that,
+    a channel that can list only what changed since a time passes
+    ``refresh`` and the delta is merged in, until the snapshot is
+    ``max_age`` old and is relisted in full. ``put`` writes our own
+    creates through so they are never missing from a warm read.
+
+    Off unless the channel config sets ``snapshot_ttl`` (seconds).
+    """
+    default_max_age = 86400
+
+    def __init__(self, path, channel, account, ttl=0, max_age=None):
+        self.path = path
+        self.channel = channel
+        self.account = str(account or '')
+        self.ttl = float(ttl or 0)
+        self.max_age = float(self.default_max_age if max_age is None
+                             else max_age)
+        self.lock = threading.Lock()
+        self.ready = False
+
+    @classmethod
+    def from_config(cls, path, channel, account, config):
+        """Store configured from ``snapshot_ttl`` / ``snapshot_max_age``
+        in a channel config.
+
+        :param path: sqlite file, usually under the channel config dir
+        :param channel: channel label, e.g. 'fb'
+        :param account: the account the listings belong to
+        :param config: the channel's loaded config dict (may be None)
+        :returns: SnapshotStore (disabled when no ttl is configured)
+        """
+        config = config if isinstance(config, dict) else {}
+        values = {}
+        for key in ('snapshot_ttl', 'snapshot_max_age'):
+            value = config.get(key)
+            if value in (None, ''):
+                continue
+            try:
+                values[key] = max(0.0, float(value))
+            except (TypeError, ValueError):
+                logging.warning(f'{key} is not a number: {value!r}.  '
+                                f'Ignoring it.')
+        return cls(path, channel, account, values.get('snapshot_ttl', 0),
+                   values.get('snapshot_max_age'))
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and bool(self.account)
+
+    @staticmethod
+    def encode(row):
+        if hasattr(row, '_asdict'):
+            row = row._asdict()
+        return json.dumps(row, default=str)
+
+    def connect(self):
+        dir_check(os.path.dirname(self.path) or '.')
+        con = sqlite3.connect(self.path, timeout=30)
+        with self.lock:
+            if not self.ready:
+                con.executescript(
+                    'CREATE TABLE IF NOT EXISTS snapshot ('
+                    'channel TEXT, account TEXT, kind TEXT, scope TEXT, '
+                    'fetched_at REAL, '
+                    'PRIMARY KEY (channel, account, kind, scope));'
+                    'CREATE TABLE IF NOT EXISTS snapshot_row ('
+                    'channel TEXT, account TEXT, kind TEXT, scope TEXT, '
+                    'key TEXT, row TEXT, '
+                    'PRIMARY KEY (channel, account, kind, scope, key));')
+                self.ready = True
+        return contextlib.closing(con)
+
+    def load(self, kind, scope=''):
+        """(``{key: row dict}``, fetched_at) of a snapshot, or
+        (None, None) when there is none."""
+        head = (self.channel, self.account, kind, str(scope))
+        with self.connect() as con:
+            found = con.execute(
+                'SELECT fetched_at FROM snapshot WHERE channel=? AND '
+                'account=? AND kind=? AND scope=?', head).fetchone()
+            if not found:
+                return None, None
+            rows = con.execute(
+                'SELECT key, row FROM snapshot_row WHERE channel=? AND '
+                'account=? AND kind=? AND scope=?', head).fetchall()
+        return {k: json.loads(v) for k, v in rows}, found[0]
+
+    def save(self, kind, rows, scope='', fetched_at=None, replace=True):
+        """Store ``rows`` as the snapshot, replacing it unless
+        ``replace`` is False (an incremental merge)."""
+        head = (self.channel, self.account, kind, str(scope))
+        with self.connect() as con, con:
+            if replace:
+                con.execute(
+                    'DELETE FROM snapshot_row WHERE channel=? AND '
+                    'account=? AND kind=? AND scope=?', head)
+            con.executemany(
+                'INSERT OR REPLACE INTO snapshot_row VALUES (?,?,?,?,?,?)',
+                [head + (str(k), self.encode(v)) for k, v in rows.items()])
+            con.execute('INSERT OR REPLACE INTO snapshot VALUES (?,?,?,?,?)',
+                        head + (fetched_at or time.time(),))
+
+    def put(self, kind, key, row, scope=''):
+        """Write one created object through to an existing snapshot."""
+        if not self.enabled or not key:
+            return
+        head = (self.channel, self.account, kind, str(scope))
+        with self.connect() as con, con:
+            con.execute(
+                'INSERT OR REPLACE INTO snapshot_row SELECT channel, '
+                'account, kind, scope, ?, ? FROM snapshot WHERE channel=? '
+                'AND account=? AND kind=? AND scope=?',
+                (str(key), self.encode(row)) + head)
+
+    def id_dict(self, kind, fetch, scope='', refresh=None, decode=None):
+        """The ``kind`` id dict from the snapshot when it is fresh,
+        else refreshed or relisted and stored.
+
+        :param kind: listing name, e.g. 'campaign'
+        :param fetch: callable returning the full listing as an IdDict
+        :param scope: the parent filter the listing was made under
+        :param refresh: callable taking the snapshot time and the
+            snapshot's id dict and returning the rows changed since
+            (None to relist in full)
+        :param decode: callable turning a stored row dict back into a row
+        :returns: IdDict
+        """
+        if not self.enabled:
+            return fetch()
+        rows, fetched_at = self.load(kind, scope)
+        now = time.time()
+        if rows is not None:
+            age = now - fetched_at
+            if age < self.ttl or (refresh and age < self.max_age):
+                id_dict = IdDict(
+                    (k, decode(v) if decode else v) for k, v in rows.items())
+                if age < self.ttl:
+                    logging.info(f'Using {self.channel} {kind} snapshot '
+                                 f'({len(id_dict)} rows, {int(age)}s old).')
+                    return id_dict
+                delta = refresh(fetched_at, id_dict)
+                id_dict.update(delta)
+                self.save(kind, delta, scope, now, replace=False)
+                logging.info(f'Refreshed {self.channel} {kind} snapshot '
+                             f'with {len(delta)} changed rows.')
+                return id_dict
+        id_dict = fetch()
+        self.save(kind, id_dict, scope, now)
+        return id_dict
+
+
 class BaseUploadConfig(object):
     """Excel-backed upload config shared by every channel's level.
 
@@ -270,6 +1170,50 @@ class BaseCreativeStore(object):
                             'not saved.'.format(self.id_file_name))
 
 
+class Base64JsonBody(object):
+    """File-like JSON request body carrying one file base64-encoded in
+    place of ``placeholder``. The file is encoded a block at a time as
+    the body is read, so it is never held in memory whole, and ``len``
+    is known up front so the request goes out with a Content-Length.
+
+    :param file_path: file whose bytes become the placeholder string
+    :param payload: JSON-able request body containing ``placeholder``
+    :param placeholder: string value standing in for the data
+    """
+    block = 3 << 16
+
+    def __init__(self, file_path, payload, placeholder='@data@'):
+        head, tail = json.dumps(payload).split(json.dumps(placeholder))
+        self.head = '{}"'.format(head).encode('utf-8')
+        self.tail = '"{}'.format(tail).encode('utf-8')
+        self.file_path = file_path
+        size = os.path.getsize(file_path)
+        self.length = len(self.head) + 4 * ((size + 2) // 3) + len(self.tail)
+        self.buffer = b''
+        self.chunks = self.encode()
+
+    def __len__(self):
+        return self.length
+
+    def encode(self):
+        yield self.head
+        with open(self.file_path, 'rb') as f:
+            for data in iter(lambda: f.read(self.block), b''):
+                yield base64.b64encode(data)
+        yield self.tail
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
 def dir_remove(directory):
     if os.path.isdir(directory):
         if not os.listdir(directory):